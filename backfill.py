@@ -0,0 +1,150 @@
+"""
+Preenche a série local (HISTORY_DB) com o histórico de todos os municípios do brasil.io
+
+As séries são buscadas em paralelo com um limite de requisições simultâneas
+e um intervalo mínimo entre requisições para cada host, e gravadas em lotes.
+A própria série local serve de checkpoint: um município que já tem a data
+atual do brasil.io é ignorado, então uma execução interrompida continua de
+onde parou. Depois disso o /chart de qualquer município é uma leitura local.
+Os benchmarks (bench) rodam com HISTORY_DB vazio e não devem usar o mesmo
+arquivo, senão as séries das fixtures são servidas pelo bot.
+
+python backfill.py --workers 8 --per-host 4 --delay 0.25
+"""
+
+import sys
+import time
+import json
+import argparse
+import threading
+import http.client
+
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dasbot import history
+from dasbot import brasil_io
+from dasbot.corona import http_get
+from dasbot.brasil_io import BrasilIOData
+
+SERIES_URL = "https://brasil.io/api/dataset/covid19/caso/data?city_ibge_code={}"
+
+
+class HostLimiter(object):
+    """Limita as requisições simultâneas e o intervalo entre requisições de cada host"""
+
+    def __init__(self, per_host, delay):
+        self.per_host = per_host
+        self.delay = delay
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = [threading.BoundedSemaphore(self.per_host), threading.Lock(), 0.0]
+            return self._hosts[host]
+
+    def get(self, url):
+        slots, lock, _ = state = self._host(urlparse(url).netloc)
+        with slots:
+            with lock:
+                wait = state[2] - time.monotonic()
+                state[2] = max(state[2], time.monotonic()) + self.delay
+            if wait > 0:
+                time.sleep(wait)
+            return http_get(url)
+
+
+def fetch_page(url, limiter):
+    """Página da série já decodificada ou None se a requisição ou a leitura falhou"""
+    try:
+        response = limiter.get(url)
+        data = json.loads(response.read()) if response else None
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        print("Falha ao ler {}: {}".format(url, e))
+        return None
+    return data if isinstance(data, dict) and "results" in data else None
+
+
+def fetch_series(code, limiter, retries=3):
+    """Todas as páginas da série do município ou None se alguma página falhou"""
+    records = []
+    next_page = SERIES_URL.format(code)
+    while next_page:
+        for attempt in range(retries):
+            data = fetch_page(next_page, limiter)
+            if data:
+                break
+            if attempt < retries - 1:
+                time.sleep(2 ** attempt)
+        else:
+            return None
+        records.extend(data["results"])
+        next_page = data.get("next")
+    return records
+
+
+def pending_cities(force=False, uf=None, limit=None):
+    """(código, data atual) dos municípios sem a data atual na série local, os com mais casos primeiro"""
+    if not brasil_io._raw_data:
+        BrasilIOData.load()
+    cities = [rec for rec in brasil_io._raw_data
+              if rec.get("city") and rec.get("city_ibge_code") and (not uf or rec.get("state") == uf)]
+    cities.sort(key=lambda rec: rec.get("confirmed") or 0, reverse=True)
+    stored = {} if force else history.latest_dates("brasil_io")
+    pending = [(rec["city_ibge_code"], rec["date"]) for rec in cities
+               if stored.get(str(rec["city_ibge_code"]), "") < rec["date"]]
+    return pending[:limit] if limit else pending, len(cities)
+
+
+def backfill(cities, workers=8, per_host=4, delay=0.25, batch=50):
+    """Busca as séries e grava a cada batch municípios. Retorna (gravados, falhas, linhas)"""
+    limiter = HostLimiter(per_host, delay)
+    done = failed = rows = 0
+    buffer = []
+    buffered = 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_series, code, limiter): code for code, _ in cities}
+        for future in as_completed(futures):
+            records = future.result()
+            if records is None:
+                failed += 1
+                continue
+            buffer.extend(history.brasil_io_rows(records))
+            buffered += 1
+            if buffered >= batch:
+                rows += history.add("brasil_io", buffer)
+                done += buffered
+                buffer, buffered = [], 0
+                print("{}/{} municípios, {} falhas, {:.0f}s".format(
+                    done + failed, len(cities), failed, time.monotonic() - start))
+    rows += history.add("brasil_io", buffer)
+    done += buffered
+    return done, failed, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python backfill.py")
+    parser.add_argument("--workers", type=int, default=8, help="séries buscadas ao mesmo tempo")
+    parser.add_argument("--per-host", type=int, default=4, help="requisições simultâneas por host")
+    parser.add_argument("--delay", type=float, default=0.25, help="intervalo mínimo entre requisições ao host")
+    parser.add_argument("--batch", type=int, default=50, help="municípios gravados por transação")
+    parser.add_argument("--uf", help="apenas os municípios da UF")
+    parser.add_argument("--limit", type=int, help="apenas os N municípios com mais casos")
+    parser.add_argument("--force", action="store_true", help="busca também os municípios já atualizados")
+    options = parser.parse_args()
+
+    if not history.enabled():
+        print("HISTORY_DB vazio, a série local está desativada")
+        return 1
+    cities, total = pending_cities(options.force, options.uf and options.uf.upper(), options.limit)
+    print("{} de {} municípios para buscar".format(len(cities), total))
+    done, failed, rows = backfill(cities, options.workers, options.per_host, options.delay, options.batch)
+    print("{} municípios gravados ({} linhas), {} falhas".format(done, rows, failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+Servidor http local que responde as requisições das fontes com as fixtures
+
+install() redireciona o urlopen usado pelo http_get para o servidor local,
+sem alterar as urls usadas pelas fontes de dados.
+"""
+
+import time
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import BaseHandler, Request, build_opener, install_opener
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        # o path tem o formato /<host><caminho original>
+        url = "https:/{}".format(self.path)
+        fixture = self.server.fixtures.get(url)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if not fixture:
+            self.send_error(404)
+            return
+        body, headers = fixture
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeServer(object):
+    """Servidor das fixtures em uma porta local, executado em uma thread
+
+    delay simula a latência de rede de cada resposta, em segundos
+    """
+
+    def __init__(self, fixtures, delay=0):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _FixtureHandler)
+        self._server.daemon_threads = True
+        self._server.fixtures = fixtures
+        self._server.delay = delay
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}".format(self._server.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _ReplayHandler(BaseHandler):
+    """Troca a url das fontes pela url do servidor local antes da requisição"""
+
+    handler_order = 100
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def default_open(self, req):
+        if req.full_url.startswith(self.base_url):
+            return None
+        local = "{}/{}{}".format(self.base_url, req.host, req.selector)
+        return self.parent.open(Request(local, headers=dict(req.header_items())), timeout=req.timeout)
+
+
+def install(server):
+    """Redireciona o urlopen global para o servidor de fixtures"""
+    install_opener(build_opener(_ReplayHandler(server.base_url)))
+
+
+def uninstall():
+    install_opener(None)
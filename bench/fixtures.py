@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fixtures das fontes de dados para os benchmarks
+
+As respostas de cada url ficam em um diretório com um manifest.json que mapeia
+a url para o arquivo e os headers da resposta. As fixtures podem ser gravadas
+das fontes reais (record) ou geradas com um tamanho configurável (generate).
+"""
+
+import os
+import gzip
+import json
+import random
+import hashlib
+
+from datetime import datetime, timedelta
+from urllib.request import urlopen, Request
+
+from dasbot.corona import br_ufs
+
+
+BRASIL_IO = "https://brasil.io/api/dataset/covid19/caso/data"
+WORLD_O_METER = "https://www.worldometers.info/coronavirus/"
+OMS = "https://dashboards-dev.sprinklr.com/data/9043/global-covid19-who-gis.json"
+G1 = "https://api.especiaisg1.globo/api/eventos/brasil/"
+GOV_BR = "https://xx9p7hp1p7.execute-api.us-east-1.amazonaws.com/prod/"
+
+# quantidade de municípios e de dias de histórico de cada tamanho de dataset
+SIZES = {
+    "small": {"cities": 500, "days": 60},
+    "medium": {"cities": 2000, "days": 180},
+    "large": {"cities": 5570, "days": 365}
+}
+
+# cidades conhecidas, usadas nos benchmarks por região
+CAPITALS = [
+    ("São Paulo", "SP", 3550308),
+    ("Rio de Janeiro", "RJ", 3304557),
+    ("Belo Horizonte", "MG", 3106200),
+    ("Salvador", "BA", 2927408),
+    ("Manaus", "AM", 1302603)
+]
+
+_PAGE_SIZE = 1000
+_LAST_DATE = datetime(2020, 12, 31)
+
+
+class Fixtures(object):
+    """Conjunto de respostas gravadas em um diretório"""
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = {}
+        manifest = os.path.join(path, "manifest.json")
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                self.manifest = json.load(f)
+
+    def add(self, url, body, headers=None):
+        os.makedirs(self.path, exist_ok=True)
+        file_name = "{}.body".format(hashlib.sha1(url.encode("utf-8")).hexdigest())
+        with open(os.path.join(self.path, file_name), "wb") as f:
+            f.write(body)
+        self.manifest[url] = {"file": file_name, "headers": headers or {"Content-Type": "application/json"}}
+
+    def get(self, url):
+        """Retorna o conteúdo e os headers da url ou None se não houver fixture"""
+        entry = self.manifest.get(url)
+        if not entry:
+            return None
+        with open(os.path.join(self.path, entry["file"]), "rb") as f:
+            return f.read(), entry["headers"]
+
+    def save(self):
+        with open(os.path.join(self.path, "manifest.json"), "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+
+
+def _add_pages(fixtures, url, records):
+    """Grava os registros no formato paginado da API do brasil.io"""
+    pages = [records[i:i + _PAGE_SIZE] for i in range(0, len(records), _PAGE_SIZE)] or [[]]
+    for i, page in enumerate(pages):
+        page_url = url if i == 0 else "{}&page={}".format(url, i + 1)
+        next_page = "{}&page={}".format(url, i + 2) if i + 1 < len(pages) else None
+        body = {"count": len(records), "next": next_page, "previous": None, "results": page}
+        fixtures.add(page_url, json.dumps(body).encode("utf-8"))
+
+
+def _cities(size, rnd):
+    prefixes = ["São", "Santa", "Nova", "Bom", "Porto", "Campo", "Rio", "Serra", "Vila", "Lagoa"]
+    suffixes = ["Jardim", "Alegre", "Esperança", "Verde", "Bonito", "Grande", "Redondo", "Claro", "Azul", "Fundo"]
+    ufs = list(br_ufs.keys())
+    cities = list(CAPITALS)
+    counters = {uf: 1 for uf in ufs}
+    while len(cities) < size:
+        uf = rnd.choice(ufs)
+        name = "{} {} {}".format(rnd.choice(prefixes), rnd.choice(suffixes), counters[uf])
+        code = int(br_ufs[uf]["uid"]) * 100000 + counters[uf]
+        counters[uf] += 1
+        cities.append((name, uf, code))
+    return cities
+
+
+def _curve(rnd, days, scale):
+    """Série acumulada de casos e óbitos crescendo de forma logística"""
+    series = []
+    total = scale * rnd.uniform(0.5, 1.5)
+    middle = days * rnd.uniform(0.3, 0.7)
+    for day in range(days):
+        cases = int(total / (1 + 2.718 ** (-(day - middle) / (days / 10))))
+        series.append((cases, int(cases * rnd.uniform(0.02, 0.05))))
+    return series
+
+
+def _brasil_io_record(city, uf, code, date, cases, deaths, is_last=True):
+    return {
+        "city": city,
+        "city_ibge_code": code,
+        "confirmed": cases,
+        "confirmed_per_100k_inhabitants": round(cases / 1000, 3),
+        "date": date.strftime("%Y-%m-%d"),
+        "death_rate": round(deaths / cases, 4) if cases else None,
+        "deaths": deaths,
+        "estimated_population_2019": 100000,
+        "is_last": is_last,
+        "order_for_place": 1,
+        "place_type": "city" if city else "state",
+        "state": uf
+    }
+
+
+def _world_page(rnd, cases, deaths, recovery):
+    countries = ["Country{}".format(i) for i in range(220)]
+    rows = []
+    for i, country in enumerate(countries):
+        if i == 110:
+            href, name, values = "country/brazil/", "Brazil", (cases, deaths, recovery)
+        else:
+            href, name = "country/{}/".format(country.lower()), country
+            values = (rnd.randint(1, 10 ** 6), rnd.randint(0, 10 ** 4), rnd.randint(0, 10 ** 5))
+        rows.append('<tr style="">\n<td style="font-weight: bold; font-size:15px; text-align:left;">'
+                    '<a class="mt_a" href="{0}">{1}</a></td>\n'
+                    '<td style="font-weight: bold; text-align:right">{2:,}</td>\n'
+                    '<td style="font-weight: bold; text-align:right;background-color:#FFEEAA;">+{3:,}</td>\n'
+                    '<td style="font-weight: bold; text-align:right;">{4:,}</td>\n'
+                    '<td style="font-weight: bold; text-align:right;background-color:red; color:white">+{5}</td>\n'
+                    '<td style="font-weight: bold; text-align:right">{6:,}</td>\n'
+                    '<td style="text-align:right;font-weight:bold;">{7:,}</td>\n'
+                    '<td style="font-weight: bold; text-align:right">{8}</td>\n</tr>'
+                    .format(href, name, values[0], rnd.randint(0, 5000), values[1], rnd.randint(0, 100),
+                            values[2], max(values[0] - values[1] - values[2], 0), rnd.randint(0, 8000)))
+    filler = "\n".join('<script type="text/javascript">var x{0} = "{1}";</script>'.format(i, "a" * 200)
+                       for i in range(600))
+    table = '<table id="main_table_countries_{}">\n<tbody>\n{}\n</tbody>\n</table>'
+    page = ('<!DOCTYPE html>\n<html>\n<head>\n{0}\n</head>\n<body>\n'
+            '<div style="font-size:13px; color:#999; margin-top:5px; text-align:center">'
+            'Last updated: {1} GMT</div>\n{2}\n{3}\n</body>\n</html>').format(
+        filler, _LAST_DATE.strftime("%B %d, %Y, %H:%M"),
+        table.format("today", "\n".join(rows)), table.format("yesterday", "\n".join(rows)))
+    return page.encode("utf-8")
+
+
+def generate(path, size="small", seed=42):
+    """Gera as fixtures de todas as fontes com o tamanho informado"""
+    rnd = random.Random(seed)
+    days = SIZES[size]["days"]
+    dates = [_LAST_DATE - timedelta(days=days - 1 - i) for i in range(days)]
+    fixtures = Fixtures(path)
+
+    # brasil.io: últimos dados de estados e cidades, histórico dos estados e das capitais
+    cities = _cities(SIZES[size]["cities"], rnd)
+    last = []
+    state_totals = {uf: [0, 0] for uf in br_ufs}
+    city_curves = {}
+    for city, uf, code in cities:
+        curve = _curve(rnd, days, 2000)
+        city_curves[code] = curve
+        cases, deaths = curve[-1]
+        state_totals[uf][0] += cases
+        state_totals[uf][1] += deaths
+        last.append(_brasil_io_record(city, uf, code, dates[-1], cases, deaths))
+    series = []
+    for uf, info in br_ufs.items():
+        cases, deaths = state_totals[uf]
+        last.append(_brasil_io_record(None, uf, int(info["uid"]), dates[-1], cases, deaths))
+        curve = _curve(rnd, days, max(cases, 1))
+        region_series = [_brasil_io_record(None, uf, int(info["uid"]), date, c, d, i == days - 1)
+                         for i, (date, (c, d)) in enumerate(zip(dates, curve))][::-1]
+        series.extend(region_series)
+        _add_pages(fixtures, "{}?city_ibge_code={}".format(BRASIL_IO, info["uid"]), region_series)
+    rnd.shuffle(last)
+    _add_pages(fixtures, "{}?is_last=True".format(BRASIL_IO), last)
+    _add_pages(fixtures, "{}?place_type=state".format(BRASIL_IO), series)
+    for city, uf, code in CAPITALS:
+        region_series = [_brasil_io_record(city, uf, code, date, c, d, i == days - 1)
+                         for i, (date, (c, d)) in enumerate(zip(dates, city_curves[code]))][::-1]
+        _add_pages(fixtures, "{}?city_ibge_code={}".format(BRASIL_IO, code), region_series)
+
+    total_cases = sum(v[0] for v in state_totals.values())
+    total_deaths = sum(v[1] for v in state_totals.values())
+
+    # worldometers
+    fixtures.add(WORLD_O_METER, _world_page(rnd, total_cases, total_deaths, total_cases // 2),
+                 {"Content-Type": "text/html; charset=utf-8"})
+
+    # OMS: uma linha por dia e país, compactado com gzip
+    rows = []
+    for i, date in enumerate(dates):
+        timestamp = int(date.timestamp() * 1000)
+        for country in ["AR", "BR", "CL", "US", "IT"]:
+            cases = int(total_cases * (i + 1) / days)
+            deaths = int(total_deaths * (i + 1) / days)
+            rows.append([timestamp, country, "AMRO", 0, deaths, 0, cases])
+    oms = {"dimensions": [], "metrics": [], "rows": rows}
+    fixtures.add(OMS, gzip.compress(json.dumps(oms).encode("utf-8")),
+                 {"Content-Type": "application/json", "Content-Encoding": "gzip"})
+
+    # G1: casos novos por dia e cidade dos últimos 30 dias
+    docs = []
+    for city, uf, code in cities:
+        curve = city_curves[code]
+        for i in range(max(days - 30, 1), days):
+            docs.append({"state": uf, "city_name": city, "date": dates[i].strftime("%Y-%m-%d"),
+                         "cases": curve[i][0] - curve[i - 1][0], "deaths": curve[i][1] - curve[i - 1][1],
+                         "recovery": 0})
+    g1 = {"updated_at": "{}, às {}".format(_LAST_DATE.strftime("%d/%m/%Y"), _LAST_DATE.strftime("%H:%M")),
+          "docs": docs}
+    fixtures.add(G1, json.dumps(g1).encode("utf-8"))
+
+    # Ministério da Saúde
+    gov_br = {"dt_updated": _LAST_DATE.isoformat() + "Z",
+              "confirmados": {"total": str(total_cases), "recuperados": str(total_cases // 2)},
+              "obitos": {"total": str(total_deaths)}}
+    fixtures.add(GOV_BR + "PortalGeralApi", json.dumps(gov_br).encode("utf-8"))
+    states = [{"nome": uf, "casosAcumulado": v[0], "obitosAcumulado": v[1]} for uf, v in state_totals.items()]
+    fixtures.add(GOV_BR + "PortalEstado", json.dumps(states).encode("utf-8"))
+
+    fixtures.save()
+    return fixtures
+
+
+def record(path):
+    """Grava as respostas atuais das fontes reais, seguindo a paginação do brasil.io"""
+    fixtures = Fixtures(path)
+    urls = [WORLD_O_METER, OMS, G1, GOV_BR + "PortalGeralApi", GOV_BR + "PortalEstado"]
+    pages = ["{}?is_last=True".format(BRASIL_IO), "{}?place_type=state".format(BRASIL_IO)]
+    pages += ["{}?city_ibge_code={}".format(BRASIL_IO, code) for _, _, code in CAPITALS]
+    pages += ["{}?city_ibge_code={}".format(BRASIL_IO, info["uid"]) for info in br_ufs.values()]
+    headers = {"User-Agent": "Mozilla/5.0", "Accept-Encoding": "gzip",
+               "x-parse-application-id": "unAFkcaNDeXajurGB7LChj8SgQYS2ptm"}
+    for url in urls:
+        response = urlopen(Request(url, headers=headers))
+        fixtures.add(url, response.read(), {k: v for k, v in response.getheaders()
+                                            if k in ("Content-Type", "Content-Encoding")})
+    for url in pages:
+        while url:
+            response = urlopen(Request(url, headers=headers))
+            body = response.read()
+            fixtures.add(url, body)
+            url = json.loads(body).get("next")
+    fixtures.save()
+    return fixtures
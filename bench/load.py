@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+Gerador de carga para os comandos do bot
+
+Envia updates sintéticos para o Dispatcher configurado pelo bot (bot.add_handlers),
+com as fontes de dados respondidas pelas fixtures e o Telegram por um stub local.
+Mostra a vazão total e a latência p50/p95/p99 de cada tipo de comando.
+
+Uso (na raiz do repositório):
+    python -m bench.load [--duration 30] [--concurrency 8] [--mix general=50,stats=20,chart=10,inline=20]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# removido quando o processo termina
+_snapshot_dir = tempfile.TemporaryDirectory(prefix="bench-snapshots-")
+os.environ.setdefault("SNAPSHOT_DIR", _snapshot_dir.name)
+# as séries das fixtures não podem ir para a série local do bot
+os.environ.setdefault("HISTORY_DB", "")
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+from telegram import Update
+from telegram.ext import Updater
+
+from bench import fixtures as bench_fixtures
+from bench.fake_server import FakeServer, install, uninstall
+from bench.telegram_stub import TelegramStub
+from bench.run import DATA_DIR, _load_all
+
+from dasbot import bot
+from dasbot.corona import br_ufs
+
+
+DEFAULT_MIX = "general=50,stats=20,chart=10,inline=20"
+REGIONS = list(br_ufs.keys()) + [city for city, _, _ in bench_fixtures.CAPITALS]
+
+
+class UpdateFactory(object):
+    """Cria updates sintéticos de mensagens, comandos e consultas inline"""
+
+    def __init__(self, bot_instance, seed=42):
+        self._bot = bot_instance
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def _user(self, chat_id):
+        return {"id": chat_id, "is_bot": False, "first_name": "Load", "username": "load{}".format(chat_id)}
+
+    def _message(self, text, command=None):
+        update_id = self._id()
+        chat_id = 100000 + update_id % 5000
+        message = {"message_id": update_id, "date": int(time.time()), "text": text,
+                   "chat": {"id": chat_id, "type": "private", "username": "load{}".format(chat_id)},
+                   "from": self._user(chat_id)}
+        if command:
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return Update.de_json({"update_id": update_id, "message": message}, self._bot)
+
+    def create(self, kind):
+        region = self._rnd.choice(REGIONS)
+        if kind == "general":
+            return self._message(region)
+        elif kind == "stats":
+            return self._message("/stats", "/stats")
+        elif kind == "chart":
+            regions = ", ".join(self._rnd.sample(REGIONS, self._rnd.randint(1, 3)))
+            return self._message("/chart {}".format(regions), "/chart")
+        elif kind == "inline":
+            update_id = self._id()
+            query = {"id": str(update_id), "from": self._user(update_id), "query": region, "offset": ""}
+            return Update.de_json({"update_id": update_id, "inline_query": query}, self._bot)
+        raise ValueError(kind)
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        kind, weight = item.split("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(duration, concurrency, mix, warm=True):
+    """Executa a carga e retorna a latência de cada tipo de comando e o tempo total"""
+    path = os.path.join(DATA_DIR, "fixtures", "medium")
+    fixtures = bench_fixtures.Fixtures(path)
+    if not fixtures.manifest:
+        fixtures = bench_fixtures.generate(path, "medium")
+    server = FakeServer(fixtures).start()
+    telegram = TelegramStub().start()
+    install(server)
+
+    updater = Updater("123:load", base_url=telegram.base_url, use_context=True)
+    dp = updater.dispatcher
+    bot.add_handlers(dp)
+    errors = defaultdict(int)
+    current = threading.local()
+
+    def count_error(update, context):
+        errors[current.kind] += 1
+
+    dp.add_error_handler(count_error)
+
+    if warm:
+        _load_all()
+
+    factory = UpdateFactory(updater.bot)
+    kinds = list(mix.keys())
+    weights = [mix[k] for k in kinds]
+    latencies = defaultdict(list)
+    deadline = time.monotonic() + duration
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        while time.monotonic() < deadline:
+            kind = rnd.choices(kinds, weights)[0]
+            update = factory.create(kind)
+            current.kind = kind
+            start = time.perf_counter()
+            dp.process_update(update)
+            latencies[kind].append(time.perf_counter() - start)
+
+    start = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(worker, i) for i in range(concurrency)]:
+                future.result()
+    finally:
+        elapsed = time.monotonic() - start
+        uninstall()
+        server.stop()
+        telegram.stop()
+    return latencies, errors, elapsed, telegram.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.load")
+    parser.add_argument("--duration", type=float, default=30, help="duração em segundos")
+    parser.add_argument("--concurrency", type=int, default=8, help="threads enviando updates")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="peso de cada comando")
+    parser.add_argument("--cold", action="store_true", help="não carrega as fontes antes da carga")
+    options = parser.parse_args()
+
+    latencies, errors, elapsed, calls = run(options.duration, options.concurrency,
+                                            parse_mix(options.mix), not options.cold)
+    total = sum(len(v) for v in latencies.values())
+    print("{:10} {:>8} {:>8} {:>10} {:>10} {:>10}".format("comando", "total", "erros", "p50(ms)", "p95(ms)", "p99(ms)"))
+    for kind, values in sorted(latencies.items()):
+        print("{:10} {:8d} {:8d} {:10.1f} {:10.1f} {:10.1f}".format(
+            kind, len(values), errors.get(kind, 0), percentile(values, 0.5) * 1000,
+            percentile(values, 0.95) * 1000, percentile(values, 0.99) * 1000))
+    print("\n{} updates em {:.1f}s: {:.1f} updates/s com {} threads".format(
+        total, elapsed, total / elapsed if elapsed else 0, options.concurrency))
+    print("Chamadas na API do Telegram: {}".format(dict(calls)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
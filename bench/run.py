@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks dos caminhos críticos do bot sem acesso à internet
+
+As fontes de dados respondem pelas fixtures (gravadas ou geradas) através
+de um servidor http local. Cada benchmark mede a latência (mediana e p95),
+a vazão e o pico de memória (tracemalloc), em cada tamanho de dataset.
+O resultado é gravado em bench/data/results/<commit>.json e pode ser
+comparado com o de outro commit.
+
+Uso (na raiz do repositório):
+    python -m bench.run [--sizes small,medium,large] [--repeat N] [--fixtures DIR]
+    python -m bench.run compare ANTES.json DEPOIS.json [--threshold 0.2]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+import tracemalloc
+
+# os snapshots dos benchmarks não podem sobrescrever os do bot e são removidos no fim
+_snapshot_dir = tempfile.TemporaryDirectory(prefix="bench-snapshots-")
+os.environ.setdefault("SNAPSHOT_DIR", _snapshot_dir.name)
+# as séries das fixtures não podem ir para a série local do bot
+os.environ.setdefault("HISTORY_DB", "")
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+from bench import fixtures as bench_fixtures
+from bench.fake_server import FakeServer, install, uninstall
+
+from dasbot import brasil_io, world, oms, g1, gov_br
+from dasbot.corona import SeriesChart, DataPanel
+from dasbot.brasil_io import BrasilIOData
+from dasbot.world import WorldOMeterData
+from dasbot.oms import OMSData
+from dasbot.g1 import G1Data
+from dasbot.gov_br import GovBR
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def _clear_caches():
+    brasil_io._raw_data = []
+    world._world_data = {}
+    oms._oms_data = {}
+    g1._g1_data = {}
+    gov_br._gov_br_data = {}
+
+
+def _load_all():
+    for source in [BrasilIOData, WorldOMeterData, OMSData, G1Data, GovBR]:
+        source.load()
+
+
+def _refreshed(corona):
+    corona.refresh()
+    return corona
+
+
+def benchmarks():
+    """Lista de (nome, preparação, função medida)
+    A preparação é executada uma vez e o seu retorno é passado para a função medida
+    """
+    def cold_refresh(source):
+        def run(corona):
+            _clear_caches()
+            corona.refresh()
+        return lambda: source(), run
+
+    return [
+        ("load.all", lambda: None, lambda _: _load_all()),
+        ("refresh.cold.brasil_io", *cold_refresh(lambda: BrasilIOData("SP"))),
+        ("refresh.cold.world", *cold_refresh(lambda: WorldOMeterData())),
+        ("refresh.cold.oms", *cold_refresh(lambda: OMSData())),
+        ("refresh.cold.g1", *cold_refresh(lambda: G1Data("SP"))),
+        ("refresh.cold.gov_br", *cold_refresh(lambda: GovBR("SP"))),
+        ("refresh.warm.brasil_io", lambda: (_load_all(), BrasilIOData("São Paulo"))[1], lambda c: c.refresh()),
+        ("refresh.warm.g1", lambda: (_load_all(), G1Data("São Paulo"))[1], lambda c: c.refresh()),
+        ("update_stats.brasil_io.uf", lambda: _refreshed(BrasilIOData("SP")), lambda c: c._update_stats()),
+        ("update_stats.brasil_io.city", lambda: _refreshed(BrasilIOData("Belo Horizonte")),
+         lambda c: c._update_stats()),
+        ("update_stats.g1.city", lambda: _refreshed(G1Data("Belo Horizonte")), lambda c: c._update_stats()),
+        ("update_stats.gov_br.uf", lambda: _refreshed(GovBR("RJ")), lambda c: c._update_stats()),
+        ("get_series.brasil_io.br", lambda: _refreshed(BrasilIOData()), lambda c: c.get_series()),
+        ("get_series.brasil_io.city", lambda: _refreshed(BrasilIOData("Salvador")), lambda c: c.get_series()),
+        ("get_series.oms", lambda: _refreshed(OMSData()), lambda c: c.get_series()),
+        ("get_series.g1.uf", lambda: _refreshed(G1Data("MG")), lambda c: c.get_series()),
+        ("chart.image.single", lambda: SeriesChart(_refreshed(BrasilIOData("SP"))), lambda c: c.image()),
+        ("chart.image.multi", lambda: SeriesChart(*[_refreshed(BrasilIOData(r))
+                                                    for r in ["SP", "RJ", "Manaus", "Salvador"]]),
+         lambda c: c.image()),
+        ("panel.image", lambda: DataPanel(*[_refreshed(s) for s in [WorldOMeterData(), OMSData(), BrasilIOData()]]),
+         lambda p: p.image()),
+    ]
+
+
+def measure(setup, func, repeat):
+    """Executa a função medida e retorna latência, vazão e pico de memória"""
+    arg = setup()
+    func(arg)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        times.append(time.perf_counter() - start)
+    # o tracemalloc deixa a execução mais lenta, por isso roda separado
+    tracemalloc.start()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    times.sort()
+    mean = statistics.mean(times)
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "p95_ms": times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+        "ops_s": 1 / mean if mean else 0,
+        "peak_kb": peak / 1024
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(sizes, repeat, fixtures_dir=None, only=None):
+    result = {"commit": _commit(), "python": platform.python_version(), "date": time.strftime("%Y-%m-%d %H:%M"),
+              "repeat": repeat, "results": {}}
+    for size in sizes:
+        if fixtures_dir:
+            fixtures = bench_fixtures.Fixtures(fixtures_dir)
+        else:
+            path = os.path.join(DATA_DIR, "fixtures", size)
+            fixtures = bench_fixtures.Fixtures(path)
+            if not fixtures.manifest:
+                print("Gerando fixtures {} em {}".format(size, path))
+                fixtures = bench_fixtures.generate(path, size)
+        server = FakeServer(fixtures).start()
+        install(server)
+        try:
+            result["results"][size] = {}
+            for name, setup, func in benchmarks():
+                if only and not name.startswith(only):
+                    continue
+                _clear_caches()
+                stats = measure(setup, func, repeat)
+                result["results"][size][name] = stats
+                print("{:8} {:32} {:10.2f} ms {:10.2f} ms {:10.1f} op/s {:10.0f} KB".format(
+                    size, name, stats["median_ms"], stats["p95_ms"], stats["ops_s"], stats["peak_kb"]))
+        finally:
+            uninstall()
+            server.stop()
+    return result
+
+
+def compare(before, after, threshold):
+    """Mostra a variação de cada benchmark e retorna as regressões acima do limite"""
+    regressions = []
+    for size, benches in after["results"].items():
+        for name, stats in benches.items():
+            old = before["results"].get(size, {}).get(name)
+            if not old:
+                continue
+            for metric in ["median_ms", "peak_kb"]:
+                if old[metric] <= 0:
+                    continue
+                change = (stats[metric] - old[metric]) / old[metric]
+                flag = ""
+                if change > threshold:
+                    flag = " <-- regressão"
+                    regressions.append((size, name, metric, change))
+                print("{:8} {:32} {:10} {:10.2f} -> {:10.2f} {:+7.1%}{}".format(
+                    size, name, metric, old[metric], stats[metric], change, flag))
+    return regressions
+
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == "compare":
+        parser = argparse.ArgumentParser(prog="python -m bench.run compare")
+        parser.add_argument("before")
+        parser.add_argument("after")
+        parser.add_argument("--threshold", type=float, default=0.2)
+        options = parser.parse_args(args[1:])
+        with open(options.before) as f:
+            before = json.load(f)
+        with open(options.after) as f:
+            after = json.load(f)
+        regressions = compare(before, after, options.threshold)
+        print("\n{} regressões {} -> {}".format(len(regressions), before["commit"], after["commit"]))
+        return 1 if regressions else 0
+
+    parser = argparse.ArgumentParser(prog="python -m bench.run")
+    parser.add_argument("--sizes", default="small,medium,large")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--fixtures", help="diretório com fixtures gravadas (bench.fixtures.record)")
+    parser.add_argument("--only", help="executa apenas os benchmarks com esse prefixo")
+    parser.add_argument("--output", help="arquivo de resultado, padrão bench/data/results/<commit>.json")
+    options = parser.parse_args(args)
+
+    result = run(options.sizes.split(","), options.repeat, options.fixtures, options.only)
+    output = options.output or os.path.join(DATA_DIR, "results", "{}.json".format(result["commit"]))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=1)
+    print("\nResultado gravado em {}".format(output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""
+Simulação do agendador de jobs com relógio virtual
+
+Executa os callbacks reais do bot (refresh_data, on_group_notifier e
+on_change_notifier) em uma fila de jobs com relógio virtual, com as fontes
+respondidas pelas fixtures e um bot falso que apenas conta as mensagens.
+Os inscritos restaurados no início do bot ficam agrupados por região e
+intervalo (on_group_notifier); os que usaram o /listen depois disso
+(--fresh-ratio) têm cada um o seu job de on_change_notifier, como no
+set_timer.
+O relógio pula direto para o próximo job, então um dia de agendamento roda
+em segundos, limitado apenas pelo tempo real dos callbacks. Cada job ocupa
+a fila pelo tempo real que levou, como na JobQueue, e o atraso de um job é
+a diferença entre o horário previsto e o horário em que ele começou.
+
+Novas versões dos dados do brasil.io são publicadas durante a simulação
+(--releases por dia), com os casos aumentados e o changelog atualizado,
+para que os jobs tenham mudanças para notificar.
+
+Uso (na raiz do repositório):
+    python -m bench.simulate [--subscribers 1000] [--hours 24] [--refresh-time 600] [--tick 60]
+                             [--fresh-ratio 0.1]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import heapq
+import random
+import argparse
+import tempfile
+import itertools
+
+from types import SimpleNamespace
+from collections import Counter, defaultdict
+
+# snapshots gravados pela simulação, removidos quando o processo termina
+_snapshot_dir = tempfile.TemporaryDirectory(prefix="bench-snapshots-")
+os.environ.setdefault("SNAPSHOT_DIR", _snapshot_dir.name)
+os.environ.setdefault("HISTORY_DB", "")
+os.environ.setdefault("CHANNEL_ID", "-1000")
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+from bench import fixtures as bench_fixtures
+from bench.fake_server import FakeServer, install, uninstall
+from bench.run import DATA_DIR, _load_all
+
+from dasbot import bot, brasil_io, changelog, snapshot
+from dasbot.jobs import JobGroup
+from dasbot.corona import br_ufs
+from dasbot.brasil_io import BrasilIOData
+
+
+REGIONS = list(br_ufs.keys()) + [city for city, _, _ in bench_fixtures.CAPITALS]
+DEFAULT_INTERVALS = "300,600,1800,3600"
+
+
+class SimJob(object):
+    """Job da fila virtual com os atributos do telegram.ext.Job usados pelo bot"""
+
+    def __init__(self, callback, interval, repeat, context, name):
+        self.callback = callback
+        self.interval = interval
+        self.repeat = repeat
+        self.context = context
+        self.name = name
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+
+class SimJobQueue(object):
+    """JobQueue com relógio virtual: os jobs rodam em sequência, na ordem do horário previsto"""
+
+    def __init__(self, bot_instance):
+        self.bot = bot_instance
+        self.now = 0.0
+        self._heap = []
+        self._seq = itertools.count()
+
+    def _push(self, due, job):
+        heapq.heappush(self._heap, (due, next(self._seq), job))
+
+    def run_repeating(self, callback, interval, first=None, context=None, name=None):
+        job = SimJob(callback, interval, True, context, name or callback.__name__)
+        self._push(self.now + (interval if first is None else first), job)
+        return job
+
+    def run_once(self, callback, when, context=None, name=None):
+        job = SimJob(callback, when, False, context, name or callback.__name__)
+        self._push(self.now + when, job)
+        return job
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop(self):
+        due, _, job = heapq.heappop(self._heap)
+        if job.repeat and not job.removed:
+            # como na JobQueue, a próxima execução é calculada a partir do horário previsto
+            self._push(due + job.interval, job)
+        return due, job
+
+
+class FakeBot(object):
+    """Bot que só conta as mensagens enviadas por chat"""
+
+    def __init__(self):
+        self.sent = Counter()
+
+    def send_message(self, chat_id, text=None, **kwargs):
+        self.sent[chat_id] += 1
+
+    def send_photo(self, chat_id, photo=None, **kwargs):
+        self.sent[chat_id] += 1
+
+    def send_media_group(self, chat_id, media=None, **kwargs):
+        self.sent[chat_id] += 1
+
+    @property
+    def total(self):
+        return sum(self.sent.values())
+
+
+def release(growth, rnd):
+    """Publica uma nova versão do brasil.io com os casos aumentados e atualiza o changelog"""
+    data = []
+    for rec in brasil_io._raw_data:
+        rec = dict(rec)
+        factor = 1 + growth * rnd.uniform(0.5, 1.5)
+        rec["confirmed"] = int((rec.get("confirmed") or 0) * factor) + 1
+        rec["deaths"] = int((rec.get("deaths") or 0) * (1 + (factor - 1) / 2))
+        data.append(rec)
+    brasil_io._raw_data = data
+    snapshot.save("brasil_io", data)
+    # no bot o changelog é atualizado pelo listener do gerenciador de fontes
+    changelog.update("brasil_io")
+
+
+def subscribe(queue, count, intervals, new_ratio, fresh_ratio, rnd):
+    """Cria os jobs do /listen: agrupados por região e intervalo, como o restore_jobs, ou,
+    para a fração fresh_ratio, um job por chat, como o set_timer. Retorna a quantidade de timers
+    """
+    groups = {}
+    fresh = 0
+    for i in range(count):
+        region = rnd.choice(REGIONS)
+        interval = rnd.choice(intervals)
+        context = {"chat_id": str(200000 + i), "region": region, "new": rnd.random() < new_ratio, "version": 0}
+        if rnd.random() < fresh_ratio:
+            queue.run_repeating(bot.on_change_notifier, interval, first=5, context=context)
+            fresh += 1
+            continue
+        key = (region, interval)
+        if key not in groups:
+            groups[key] = JobGroup(region, interval)
+        groups[key].add(context)
+    for group in groups.values():
+        group.job = queue.run_repeating(bot.on_group_notifier, group.interval,
+                                        first=bot._first_run(group.interval), context=group)
+    return len(groups) + fresh
+
+
+def simulate(subscribers, hours, refresh_time, tick, intervals, releases, new_ratio=0.5, fresh_ratio=0.1,
+             growth=0.02, seed=42):
+    """Executa a simulação e retorna a lista de ticks e os totais por callback"""
+    rnd = random.Random(seed)
+    random.seed(seed)
+    fake_bot = FakeBot()
+    queue = SimJobQueue(fake_bot)
+    duration = hours * 3600
+
+    os.environ["REFRESH_TIME"] = str(refresh_time)
+    changelog.register("brasil_io", BrasilIOData)
+    bot.start_channel_job(queue)
+    timers = subscribe(queue, subscribers, intervals, new_ratio, fresh_ratio, rnd)
+    count = int(releases * hours / 24)
+    release_times = [duration * (i + 1) / (count + 1) for i in range(count)]
+
+    ticks = [{"tick": i, "jobs": 0, "cpu": 0.0, "busy": 0.0, "max_lag": 0.0, "messages": 0}
+             for i in range(max(1, math.ceil(duration / tick)))]
+    callbacks = defaultdict(lambda: {"runs": 0, "cpu": 0.0, "lag": 0.0})
+    clock = 0.0
+    wall_start = time.perf_counter()
+    while queue.next_due() is not None and queue.next_due() < duration:
+        due, job = queue.pop()
+        if job.removed:
+            continue
+        while release_times and release_times[0] <= max(clock, due):
+            release(growth, rnd)
+            release_times.pop(0)
+        start = max(clock, due)
+        queue.now = start
+        sent = fake_bot.total
+        cpu = time.thread_time()
+        wall = time.perf_counter()
+        job.callback(SimpleNamespace(bot=fake_bot, job=job, job_queue=queue))
+        wall = time.perf_counter() - wall
+        cpu = time.thread_time() - cpu
+        clock = start + wall
+
+        lag = start - due
+        current = ticks[min(int(start // tick), len(ticks) - 1)]
+        current["jobs"] += 1
+        current["cpu"] += cpu
+        current["busy"] += wall
+        current["max_lag"] = max(current["max_lag"], lag)
+        current["messages"] += fake_bot.total - sent
+        stats = callbacks[job.name]
+        stats["runs"] += 1
+        stats["cpu"] += cpu
+        stats["lag"] = max(stats["lag"], lag)
+    return {"subscribers": subscribers, "timers": timers, "hours": hours, "refresh_time": refresh_time,
+            "tick": tick, "elapsed": time.perf_counter() - wall_start, "ticks": ticks,
+            "callbacks": dict(callbacks), "messages": fake_bot.total}
+
+
+def _report(result, hours_per_line=1):
+    tick = result["tick"]
+    per_line = max(1, int(hours_per_line * 3600 // tick))
+    print("{:>6} {:>8} {:>10} {:>12} {:>12} {:>10}".format(
+        "hora", "jobs", "cpu(s)", "cpu/tick(ms)", "atraso(s)", "mensagens"))
+    ticks = result["ticks"]
+    for i in range(0, len(ticks), per_line):
+        chunk = ticks[i:i + per_line]
+        jobs = sum(t["jobs"] for t in chunk)
+        cpu = sum(t["cpu"] for t in chunk)
+        worst = max(t["cpu"] for t in chunk)
+        lag = max(t["max_lag"] for t in chunk)
+        messages = sum(t["messages"] for t in chunk)
+        print("{:6.1f} {:8d} {:10.2f} {:12.1f} {:12.2f} {:10d}".format(
+            i * tick / 3600, jobs, cpu, worst * 1000, lag, messages))
+    print("\n{:22} {:>8} {:>10} {:>12}".format("callback", "execuções", "cpu(s)", "atraso máx(s)"))
+    for name, stats in sorted(result["callbacks"].items()):
+        print("{:22} {:8d} {:10.2f} {:12.2f}".format(name, stats["runs"], stats["cpu"], stats["lag"]))
+    print("\n{} inscritos em {} timers, {:.0f}h simuladas em {:.1f}s, {} mensagens enviadas".format(
+        result["subscribers"], result["timers"], result["hours"], result["elapsed"], result["messages"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.simulate")
+    parser.add_argument("--subscribers", type=int, default=1000, help="chats com /listen")
+    parser.add_argument("--hours", type=float, default=24, help="horas simuladas")
+    parser.add_argument("--refresh-time", type=int, default=int(os.environ.get("REFRESH_TIME", "600")),
+                        help="intervalo do refresh_data (REFRESH_TIME)")
+    parser.add_argument("--tick", type=int, default=60, help="segundos virtuais de cada tick do relatório")
+    parser.add_argument("--intervals", default=DEFAULT_INTERVALS, help="intervalos do /listen em segundos")
+    parser.add_argument("--releases", type=int, default=4, help="novas versões do brasil.io por dia")
+    parser.add_argument("--new-ratio", type=float, default=0.5, help="fração dos inscritos com --new")
+    parser.add_argument("--fresh-ratio", type=float, default=0.1,
+                        help="fração dos inscritos desde o início do bot, com um job por chat")
+    parser.add_argument("--size", default="medium", choices=sorted(bench_fixtures.SIZES),
+                        help="tamanho das fixtures geradas")
+    parser.add_argument("--output", help="grava o resultado com os ticks em json")
+    options = parser.parse_args()
+
+    path = os.path.join(DATA_DIR, "fixtures", options.size)
+    fixtures = bench_fixtures.Fixtures(path)
+    if not fixtures.manifest:
+        fixtures = bench_fixtures.generate(path, options.size)
+    server = FakeServer(fixtures).start()
+    install(server)
+    try:
+        _load_all()
+        result = simulate(options.subscribers, options.hours, options.refresh_time, options.tick,
+                          [int(i) for i in options.intervals.split(",")], options.releases, options.new_ratio,
+                          options.fresh_ratio)
+    finally:
+        uninstall()
+        server.stop()
+        _snapshot_dir.cleanup()
+
+    _report(result)
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(result, f, indent=1)
+        print("Resultado gravado em {}".format(options.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
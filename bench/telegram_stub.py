@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stub local da API do Telegram
+
+Responde os métodos usados pelo bot com respostas válidas e conta as chamadas
+por método, sem enviar nada para o Telegram.
+"""
+
+import json
+import time
+import threading
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Corona BR Bot", "username": "corona_br_bot"}
+
+
+def _message(params, kind):
+    chat_id = params.get("chat_id", "0")
+    message = {"message_id": int(time.time() * 1000) % 1000000, "date": int(time.time()),
+               "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "private"},
+               "from": BOT_USER}
+    if kind == "photo":
+        message["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}]
+        message["caption"] = params.get("caption", "")
+    elif kind == "document":
+        message["document"] = {"file_id": "document", "file_unique_id": "document"}
+    else:
+        message["text"] = params.get("text", "")
+    return message
+
+
+class _TelegramHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        size = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(size)
+        content_type = self.headers.get("Content-Type", "")
+        params = {}
+        if content_type.startswith("application/json"):
+            params = json.loads(body or b"{}")
+        elif content_type.startswith("application/x-www-form-urlencoded"):
+            params = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+
+        self.server.calls[method] += 1
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "sendPhoto":
+            result = _message(params, "photo")
+        elif method == "sendDocument":
+            result = _message(params, "document")
+        elif method == "sendMediaGroup":
+            result = [_message(params, "photo")]
+        elif method.startswith("send"):
+            result = _message(params, "text")
+        elif method == "getUpdates":
+            result = []
+        else:
+            result = True
+
+        data = json.dumps({"ok": True, "result": result}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+class TelegramStub(object):
+    """Servidor da API do Telegram em uma porta local
+
+    Use Bot(token, base_url=stub.base_url) ou Updater(token, base_url=stub.base_url)
+    """
+
+    def __init__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _TelegramHandler)
+        self._server.daemon_threads = True
+        self._server.calls = Counter()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}/bot".format(self._server.server_address[1])
+
+    @property
+    def calls(self):
+        return self._server.calls
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="telegram-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo analytics
+Tendências do Brasil e das UFs: casos novos por dia, média móvel de 7 dias,
+taxa de crescimento diária e tempo de duplicação
+
+A série histórica dos estados do brasil.io vira uma matriz região x data e
+todas as regiões são calculadas de uma vez com operações do NumPy. O
+resultado fica em cache até a próxima versão dos dados do brasil.io, então
+as descrições e os gráficos apenas consultam os valores já calculados. O
+processo que atualiza as fontes publica as tendências no snapshot "trends",
+que os workers do cluster apenas leem.
+"""
+
+import math
+import logging
+import threading
+
+from collections import namedtuple
+
+from dasbot import snapshot, singleflight, regions, history
+from dasbot.sources import manager
+from dasbot.corona import br_ufs
+from dasbot.brasil_io import BrasilIOData
+
+# o numpy é carregado apenas no primeiro cálculo
+
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 7
+
+# valores do último dia de uma região
+Trend = namedtuple("Trend", ["date", "new", "average", "growth", "doubling"])
+
+_trends = None
+_attempted = None
+_lock = threading.Lock()
+
+
+def daily(cumulative):
+    """Casos novos por dia a partir dos acumulados (uma linha por região), sem valores negativos
+    O primeiro dia de cada série fica com 0, já que os casos anteriores são desconhecidos
+    """
+    import numpy as np
+
+    cumulative = np.asarray(cumulative, dtype=float)
+    return np.clip(np.diff(cumulative, axis=1, prepend=cumulative[:, :1]), 0, None)
+
+
+def moving_average(values, window=WINDOW):
+    """Média móvel por linha; nos primeiros dias usa os dias disponíveis"""
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    sums = np.cumsum(values, axis=-1)
+    result = sums.copy()
+    result[..., window:] = sums[..., window:] - sums[..., :-window]
+    counts = np.minimum(np.arange(1, values.shape[-1] + 1), window)
+    return result / counts
+
+
+def growth_rate(cumulative, window=WINDOW):
+    """Taxa de crescimento diária dos acumulados, média dos últimos window dias"""
+    import numpy as np
+
+    cumulative = np.asarray(cumulative, dtype=float)
+    before = np.zeros_like(cumulative)
+    before[..., window:] = cumulative[..., :-window]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.power(cumulative / before, 1 / window) - 1
+    return np.where((before > 0) & np.isfinite(rate), rate, np.nan)
+
+
+def doubling_time(rate):
+    """Dias para os casos dobrarem com a taxa de crescimento diária informada"""
+    import numpy as np
+
+    rate = np.asarray(rate, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(rate > 0, math.log(2) / np.log1p(rate), np.inf)
+
+
+def lttb(x, y, threshold):
+    """Índices dos pontos mantidos pelo Largest-Triangle-Three-Buckets
+    Mantém o primeiro e o último ponto e, em cada intervalo, o ponto que forma o maior
+    triângulo com o ponto escolhido antes e a média do próximo intervalo, preservando
+    os picos e a forma da curva
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold < 3 or n <= threshold:
+        return np.arange(n)
+    # threshold - 2 intervalos com os pontos entre o primeiro e o último
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    indices = np.empty(threshold, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def _forward_fill(matrix):
+    """Repete o último valor conhecido nas datas sem registro e usa 0 antes do primeiro"""
+    import numpy as np
+
+    missing = np.isnan(matrix)
+    index = np.where(~missing, np.arange(matrix.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    filled = matrix[np.arange(matrix.shape[0])[:, None], index]
+    return np.nan_to_num(filled, nan=0.0)
+
+
+class Trends(object):
+    """Matrizes região x data calculadas a partir da série dos estados do brasil.io"""
+
+    def __init__(self, records, version=0):
+        import numpy as np
+
+        self.version = version
+        states = [uf for uf in br_ufs]
+        rows = {uf: i + 1 for i, uf in enumerate(states)}
+        # linha 0 é o Brasil, a soma das UFs
+        self.codes = [regions.BRAZIL.code] + [int(br_ufs[uf]["uid"]) for uf in states]
+        self._rows = {code: i for i, code in enumerate(self.codes)}
+
+        records = [r for r in records if r.get("city") is None and r.get("state") in rows and r.get("date")]
+        self.dates = np.unique(np.array([r["date"] for r in records], dtype="datetime64[D]"))
+        cases = np.full((len(self.codes), len(self.dates)), np.nan)
+        deaths = np.full((len(self.codes), len(self.dates)), np.nan)
+        if records:
+            row = np.array([rows[r["state"]] for r in records])
+            column = np.searchsorted(self.dates, np.array([r["date"] for r in records], dtype="datetime64[D]"))
+            cases[row, column] = [r.get("confirmed") or 0 for r in records]
+            deaths[row, column] = [r.get("deaths") or 0 for r in records]
+        cases[0] = deaths[0] = 0
+        self.cases = _forward_fill(cases)
+        self.deaths = _forward_fill(deaths)
+        self.cases[0] = self.cases[1:].sum(axis=0)
+        self.deaths[0] = self.deaths[1:].sum(axis=0)
+
+        self.new = daily(self.cases)
+        self.average = moving_average(self.new)
+        self.growth = growth_rate(self.cases)
+        self.doubling = doubling_time(self.growth)
+
+    def row(self, code):
+        return self._rows.get(code)
+
+    def latest(self, code):
+        """Trend do último dia da região ou None se a região não está na matriz"""
+        i = self._rows.get(code)
+        if i is None or not len(self.dates):
+            return None
+        growth = float(self.growth[i, -1])
+        return Trend(self.dates[-1].item(), int(self.new[i, -1]), float(self.average[i, -1]),
+                     None if math.isnan(growth) else growth, float(self.doubling[i, -1]))
+
+
+def refresh():
+    """Busca a série dos estados e recalcula as tendências para a versão atual do brasil.io"""
+    global _trends, _attempted
+    version = snapshot.version("brasil_io")
+    _attempted = version
+    if _trends is not None and _trends.version == version:
+        return True
+    records = BrasilIOData.load_series()
+    if not records:
+        return False
+    trends = Trends(records, version)
+    history.record("brasil_io", records)
+    with _lock:
+        _trends = trends
+    snapshot.save("trends", trends)
+    logger.info("Trends computed for version %d, %d dates", version, len(trends.dates))
+    return True
+
+
+def restore():
+    """Lê as tendências publicadas se forem mais novas que as carregadas, retorna True se carregou"""
+    global _trends
+    trends = snapshot.load_if_newer("trends")
+    if trends is None:
+        return False
+    with _lock:
+        _trends = trends
+    return True
+
+
+def update(name):
+    """Listener do gerenciador de fontes: recalcula a cada nova versão do brasil.io"""
+    if name == "brasil_io":
+        refresh()
+
+
+def trends():
+    """Tendências já calculadas. Sem o gerenciador de fontes, calcula na primeira consulta de cada versão"""
+    version = snapshot.version("brasil_io")
+    if (_trends is None or _trends.version != version) and _attempted != version \
+            and not manager.is_managed("brasil_io"):
+        singleflight.do(("analytics.refresh", version), refresh)
+    return _trends
+
+
+def current():
+    """Tendências já calculadas, sem buscar dados"""
+    return _trends
+
+
+def trend(place):
+    """Trend do último dia da região (Brasil ou UF) ou None"""
+    if place is None or place.kind == regions.CITY:
+        return None
+    current = trends()
+    return current.latest(place.code) if current else None
+
+
+def average(place):
+    """{data: média de 7 dias dos casos novos} da região (Brasil ou UF) já calculada, ou None"""
+    if place is None or place.kind == regions.CITY:
+        return None
+    current = trends()
+    i = current.row(place.code) if current else None
+    if i is None or not len(current.dates):
+        return None
+    return dict(zip(current.dates.tolist(), current.average[i].tolist()))
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo api
+API HTTP somente leitura com os dados que o bot já tem em memória
+
+Permite que outros painéis usem os dados das fontes sem consultar os sites
+de origem. As respostas nunca fazem requisições externas, têm ETag com a
+versão dos snapshots (If-None-Match responde 304) e são compactadas com gzip
+quando o cliente aceita. Ativada com API_PORT.
+
+GET /api/sources             versões e datas dos snapshots das fontes
+GET /api/snapshot/<fonte>    dados completos da fonte
+GET /api/rollup              totais do Brasil e das UFs (brasil.io)
+GET /api/region/<região>     dados da região em cada fonte
+GET /api/series/<região>     série e tendências do Brasil ou de uma UF
+"""
+
+import sys
+import gzip
+import json
+import logging
+import threading
+
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dasbot import snapshot, metrics, regions, analytics
+from dasbot.brasil_io import BrasilIOData
+
+
+logger = logging.getLogger(__name__)
+
+# nome da variável global com o cache de cada fonte
+_cache_names = {"world": "_world_data", "oms": "_oms_data", "brasil_io": "_raw_data",
+                "g1": "_g1_data", "gov_br": "_gov_br_data"}
+
+_api_requests = metrics.counter("dasbot_api_requests_total", "Requisições da API por rota e status",
+                                ("route", "status"))
+
+_sources = {}
+_responses = {}
+_responses_lock = threading.Lock()
+_MAX_RESPONSES = 256
+
+
+def _cached(name):
+    """Cache global da fonte, sem carregar dados"""
+    source = _sources.get(name)
+    if not source:
+        return None
+    return getattr(sys.modules[source.__module__], _cache_names[name], None)
+
+
+def _versions_tag():
+    return "-".join(str(snapshot.version(name)) for name in _sources)
+
+
+def _source_list():
+    return {name: {"version": snapshot.version(name), "saved_at": snapshot.saved_at(name),
+                   "loaded": bool(_cached(name))} for name in _sources}
+
+
+def _snapshot(name):
+    if name not in _sources:
+        return None
+    return _cached(name) or None
+
+
+def _rollup():
+    if not _cached("brasil_io"):
+        return None
+    totals, date = BrasilIOData.rollup()
+    return {"date": date, "source": "brasil.io",
+            "regions": {region: {"confirmed": v[0], "deaths": v[1]} for region, v in totals.items()}}
+
+
+def _region(text):
+    place = regions.resolve(text)
+    if not place:
+        return None
+    result = {"region": place._asdict(), "sources": []}
+    for name, source in _sources.items():
+        # só consulta as fontes já carregadas, para não buscar os dados na origem
+        if not _cached(name):
+            continue
+        corona = source(text)
+        corona.refresh()
+        if corona.last_date:
+            data = corona.get_data()
+            result["sources"].append({"source": corona.data_source, "date": corona.last_date,
+                                      "confirmed": data[0], "deaths": data[1], "recovered": data[2]})
+    return result
+
+
+def _series(text):
+    place = regions.resolve(text)
+    trends = analytics.current()
+    row = trends.row(place.code) if place and trends else None
+    if row is None:
+        return None
+    return {"region": place._asdict(), "version": trends.version,
+            "dates": [str(d) for d in trends.dates],
+            "confirmed": trends.cases[row].tolist(), "deaths": trends.deaths[row].tolist(),
+            "new": trends.new[row].tolist(), "average": trends.average[row].tolist(),
+            "growth": [None if g != g else g for g in trends.growth[row].tolist()]}
+
+
+def _route(path):
+    """Retorna (rota, etag, função que gera o corpo) ou None"""
+    parts = [unquote(p) for p in path.strip("/").split("/")]
+    if len(parts) < 2 or parts[0] != "api":
+        return None
+    route = parts[1]
+    arg = "/".join(parts[2:])
+    if route == "sources" and not arg:
+        return route, _versions_tag(), _source_list
+    if route == "snapshot" and arg:
+        return route, "{}-{}".format(arg, snapshot.version(arg)), lambda: _snapshot(arg)
+    if route == "rollup" and not arg:
+        return route, "rollup-{}".format(snapshot.version("brasil_io")), _rollup
+    if route == "region" and arg:
+        return route, "region-{}".format(_versions_tag()), lambda: _region(arg)
+    if route == "series" and arg:
+        trends = analytics.current()
+        return route, "series-{}".format(trends.version if trends else 0), lambda: _series(arg)
+    return None
+
+
+def _response(path, etag, build):
+    """Corpo json e gzip da resposta, guardados enquanto a versão não mudar"""
+    key = (path, etag)
+    with _responses_lock:
+        if key in _responses:
+            return _responses[key]
+    data = build()
+    if data is None:
+        return None
+    body = json.dumps(data, default=str, ensure_ascii=False).encode("utf-8")
+    response = (body, gzip.compress(body, 6))
+    with _responses_lock:
+        if len(_responses) >= _MAX_RESPONSES:
+            _responses.clear()
+        _responses[key] = response
+    return response
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        route = _route(path)
+        if not route:
+            _api_requests.inc("unknown", 404)
+            self.send_error(404)
+            return
+        name, version, build = route
+        etag = '"{}"'.format(version)
+        if self.headers.get("If-None-Match") == etag:
+            _api_requests.inc(name, 304)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        response = _response(path, etag, build)
+        if not response:
+            _api_requests.inc(name, 404)
+            self.send_error(404)
+            return
+        body, compressed = response
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        data = compressed if use_gzip else body
+        _api_requests.inc(name, 200)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(port, sources, address="127.0.0.1"):
+    """Inicia a API em uma thread e retorna o servidor. sources: {nome: classe da fonte}"""
+    _sources.update(sources)
+    server = ThreadingHTTPServer((address, port), _ApiHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="api", daemon=True)
+    thread.start()
+    logger.info("API on http://%s:%d/api/sources", address, server.server_address[1])
+    return server
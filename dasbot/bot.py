@@ -6,21 +6,31 @@ Modulo bot - Mantem as funções que gerenciam o bot
 
 
 import os
+import io
 import logging
-import pickle
 import datetime
 import re
 import json
+import random
+import signal
+import threading
 
 from uuid import uuid4
+from concurrent.futures import TimeoutError
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, InlineQueryHandler
 from telegram import InlineQueryResultArticle, InputTextMessageContent, ParseMode
+from telegram.error import TelegramError
 
-from dasbot.corona import SeriesChart, DataPanel
+from dasbot.corona import SeriesChart, DataPanel, br_ufs
 from dasbot.world import WorldOMeterData
 from dasbot.oms import OMSData
 from dasbot.brasil_io import BrasilIOData
-from dasbot.db import JobCacheRepo, BotLogRepo, CasesRepo
+from dasbot.db import BotLogRepo, CasesRepo
+from dasbot.jobs import JobsInfo, JobsDBInfo, JobGroup
+from dasbot.sources import manager
+from dasbot.breaker import LatencyBudget
+from dasbot import metrics, profiler, render, snapshot, digest, changelog, breaker
+from dasbot import regions, analytics, ranking, api, prewarm
 
 
 # Enable logging
@@ -31,15 +41,18 @@ use_db = os.environ.get("USE_DB", False)
 admin_id = int(os.environ.get("ADMIN_ID", 0))
 # ajuste para o nome do canal a receber as atualizações
 channel_id = os.environ.get("CHANNEL_ID", "")
+# porta local do endpoint /metrics, desativado se não informada
+metrics_port = int(os.environ.get("METRICS_PORT", 0))
+# porta e endereço da API json com os dados das fontes, 0 desativa
+api_port = int(os.environ.get("API_PORT", 0))
+api_address = os.environ.get("API_ADDRESS", "127.0.0.1")
+# intervalo, em segundos, de leitura dos snapshots quando as fontes são atualizadas por outro processo
+snapshot_poll = int(os.environ.get("SNAPSHOT_POLL", "5"))
+# tempo máximo, em segundos, que um comando espera pelas fontes de dados
+request_budget = int(os.environ.get("REQUEST_BUDGET", "10"))
 
-if use_db:
-    logging.basicConfig(level=logging.INFO)
-else:
-    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                        filemode="a",
-                        filename="logs/log_{}.log".format(
-                            datetime.datetime.strftime(datetime.datetime.now(), "%Y_%m_%d")),
-                        level=logging.INFO)
+
+_sources = {"world": WorldOMeterData, "oms": OMSData, "brasil_io": BrasilIOData}
 
 
 def _log_message_data(message):
@@ -51,73 +64,6 @@ def _log_message_data(message):
     return json.dumps(result).replace("\"", "\'")
 
 
-class JobsInfo(object):
-    def __init__(self, file_name):
-        self._jobs = dict()
-        self.file_name = file_name
-        self._props = ["interval", "repeat", "context"]
-
-    @property
-    def jobs(self):
-        return self._jobs
-
-    def save(self):
-        with open(self.file_name, 'wb') as f:
-            data = {key: {var: getattr(job, var) for var in self._props} for key, job in self._jobs.items()}
-            pickle.dump(data, f)
-
-    def load(self):
-        if os.path.exists(self.file_name):
-            with open(self.file_name, 'rb') as f:
-                return pickle.load(f)
-        return {}
-
-    def push(self, key, data):
-        self._jobs[key] = data
-
-    def pop(self, key):
-        result = self._jobs[key]
-        del self._jobs[key]
-        return result
-
-    def exists(self, key):
-        return key in self._jobs
-
-
-class JobsDBInfo(JobsInfo):
-    def __init__(self):
-        super().__init__("")
-
-    def save(self):
-        repo = JobCacheRepo()
-        for key, job in self.jobs.items():
-            data = dict()
-            data["job_id"] = key
-            for prop in ["interval", "repeat"]:
-                data[prop] = getattr(job, prop)
-            for prop in ["region", "chat_id", "new"]:
-                data[prop] = job.context.get(prop)
-            for prop, i in {"cases": 0, "deaths": 1, "recovery": 2}.items():
-                data[prop] = job.context.get("last")[i]
-            repo.add(data)
-        repo.save()
-
-    def load(self):
-        jobs = dict()
-        repo = JobCacheRepo()
-        repo.load()
-        for row in repo.rows:
-            data = dict()
-            data["interval"] = row["interval"]
-            data["repeat"] = row["repeat"]
-            data["context"] = {"region": row["region"],
-                               "chat_id": row["chat_id"],
-                               "new": row["new"],
-                               "last": [row["cases"], row["deaths"], row["recovery"]]}
-            jobs[row["job_id"]] = data
-        return jobs
-
-
 class DBLogHandler(logging.Handler):
     def __init__(self):
         super().__init__()
@@ -138,6 +84,29 @@ class DBLogHandler(logging.Handler):
             repo.save()
 
 
+def setup_logging():
+    """Configura o log do processo. Chamado pelo main e pelos processos do cluster, e não na
+    importação, para que os processos do pool de renderização não abram o arquivo de log
+    """
+    if use_db:
+        logging.basicConfig(level=logging.INFO)
+        logger.addHandler(DBLogHandler())
+    else:
+        logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                            filemode="a",
+                            filename="logs/log_{}.log".format(
+                                datetime.datetime.strftime(datetime.datetime.now(), "%Y_%m_%d")),
+                            level=logging.INFO)
+
+
+def _refresh_sources(sources):
+    """Atualiza as fontes dentro do orçamento de latência e retorna as que têm dados"""
+    with LatencyBudget(request_budget):
+        for corona in sources:
+            corona.refresh()
+    return [corona for corona in sources if corona.last_date]
+
+
 def start(update, context):
     """Send a message when the command /start is issued."""
     update.message.reply_text("""Olá. Sou um bot de dados de casos de COVID-19 no Brasil.
@@ -152,6 +121,7 @@ def help(update, context):
     /help : mostra a ajuda
     /stats : mostra os números de casos mais atualizados do Brasil
     /chart : desenha um gráfico com a região informada, ex: /chart SP
+    /top : cidades com os maiores aumentos de casos, ex: /top 10 SP ou /top 10 %
     /listen : observa os dados de uma região a cada X minutos (experimental)
     /mute : para de observar a região programada com o /listen
 Envie uma sigla de estado ou nome de cidade, para saber os confirmados nessa região
@@ -166,14 +136,38 @@ def error(update, context):
     logger.warning('Update "%s" caused error "%s"', update, context.error)
 
 
+def _versions():
+    """Versões atuais dos dados das fontes e das tendências, parte da chave das respostas"""
+    return tuple(snapshot.version(name) for name in _sources) + (snapshot.version("trends"),)
+
+
+def _region_key(region):
+    """Código IBGE da região, para que grafias diferentes do mesmo lugar compartilhem a consulta"""
+    if not region:
+        return region
+    place = regions.resolve(region)
+    return place.code if place else " ".join(region.split())
+
+
+def _describe(region):
+    """Descrições da região em cada fonte com dados: [(fonte, data, descrição)]"""
+    if region is None:
+        sources = [WorldOMeterData(), OMSData(), BrasilIOData()]
+    else:
+        sources = [WorldOMeterData(region), OMSData(region), BrasilIOData(region)]
+    return [(corona.data_source, corona.last_date, corona.description) for corona in _refresh_sources(sources)]
+
+
+def _shared_describe(command, region):
+    # pedidos simultâneos da mesma região e versão dos dados esperam uma única consulta
+    # e a resposta fica guardada até a próxima versão
+    return prewarm.get((command, _region_key(region), _versions()), _describe, region)
+
+
 def stats(update, context):
     logger.info('Arrive /stats command "%s"', _log_message_data(update.effective_message))
-    sources = [WorldOMeterData(), OMSData(), BrasilIOData()]
-    result = []
-    for corona in sources:
-        corona.refresh()
-        if corona.last_date:
-            result.append(corona.description)
+    prewarm.touch("/stats", update.message.text)
+    result = [description for _, _, description in _shared_describe("stats", None)]
 
     if result:
         update.message.reply_markdown("Região: *{}*\n{}".format("BR", "\n".join(result)))
@@ -184,12 +178,8 @@ def stats(update, context):
 def general(update, context):
     logger.info('Arrive text message "%s"', _log_message_data(update.effective_message))
     region = update.message.text
-    result = []
-    sources = [WorldOMeterData(region), OMSData(region), BrasilIOData(region)]
-    for corona in sources:
-        corona.refresh()
-        if corona.last_date:
-            result.append(corona.description)
+    prewarm.touch("text", region)
+    result = [description for _, _, description in _shared_describe("general", region)]
 
     if result:
         update.message.reply_markdown("Região: *{}*\n{}".format(region, "\n".join(result)))
@@ -200,27 +190,43 @@ Envie /help para ver a ajuda.""")
 
 
 def _get_chart(regions):
+    """Retorna (png, legenda) do gráfico das regiões ou None"""
     sources = []
     if regions:
-        for region in regions:
-            corona = BrasilIOData(region.strip())
-            corona.refresh()
-            sources.append(corona)
+        with LatencyBudget(request_budget):
+            for region in regions:
+                corona = BrasilIOData(region.strip())
+                corona.refresh()
+                sources.append(corona)
 
-        chart_br = SeriesChart(*sources)
+            chart_br = SeriesChart(*sources)
         if chart_br.validate():
-            image = chart_br.image()
+            image = render.image(chart_br).getvalue()
             caption = "Atualizado: {}".format(sources[0].last_date.strftime("%d-%m-%Y %H:%M"))
             return image, caption
     return None
 
 
+def _chart_data(regions):
+    key = ("chart", tuple(_region_key(region) for region in regions), _versions())
+    return prewarm.get(key, _get_chart, regions)
+
+
 def chart(update, context):
     logger.info('Arrive /chart command "%s"', _log_message_data(update.effective_message))
+    prewarm.touch("/chart", update.message.text)
     regions = " ".join(context.args).split(",")
-    chart_data = _get_chart(regions)
+    try:
+        chart_data = _chart_data(regions)
+    except TimeoutError:
+        logger.warning('Chart render timeout "%s"', regions)
+        update.message.reply_text("O gráfico está demorando para ficar pronto. Tente novamente em alguns minutos.")
+        return
     if chart_data:
-        update.message.reply_photo(photo=chart_data[0], caption=chart_data[1])
+        # cada resposta usa o seu próprio arquivo, o png é compartilhado
+        photo = io.BytesIO(chart_data[0])
+        photo.name = 'series.png'
+        update.message.reply_photo(photo=photo, caption=chart_data[1])
     else:
         update.message.reply_text("""A lista de regiões não foi reconhecida. 
 Envie a sigla de estado em maiúsculas, nomes de cidade com acentos.
@@ -236,67 +242,119 @@ def inline_query(update, context):
 
     logger.info('Query inline "%s"', update.inline_query)
 
-    sources = [WorldOMeterData(query), OMSData(query), BrasilIOData(query)]
     results = []
-
-    for corona in sources:
-        corona.refresh()
-        if corona.last_date:
-            results.append(InlineQueryResultArticle(
-                id=uuid4(),
-                title="{} por {} em {}".format(query, corona.data_source, corona.last_date.strftime("%d-%m")),
-                input_message_content=InputTextMessageContent(
-                    corona.description,
-                    parse_mode=ParseMode.MARKDOWN)))
+    for data_source, last_date, description in _shared_describe("inline", query):
+        results.append(InlineQueryResultArticle(
+            id=uuid4(),
+            title="{} por {} em {}".format(query, data_source, last_date.strftime("%d-%m")),
+            input_message_content=InputTextMessageContent(
+                description,
+                parse_mode=ParseMode.MARKDOWN)))
 
     update.inline_query.answer(results, cache_time=60)
 
 
+def _format_date(text):
+    return datetime.datetime.strptime(text, "%Y-%m-%d").strftime("%d-%m-%Y")
+
+
+def top(update, context):
+    """Municípios com os maiores aumentos de casos em relação ao dia anterior"""
+    logger.info('Arrive /top command "%s"', _log_message_data(update.effective_message))
+    count, kind, uf = 10, ranking.ABSOLUTE, None
+    for arg in context.args:
+        if arg.isdigit():
+            count = max(1, min(int(arg), ranking.top_size))
+        elif arg == "%":
+            kind = ranking.RELATIVE
+        elif arg.upper() in br_ufs:
+            uf = arg.upper()
+        else:
+            update.message.reply_text("Use: /top <quantidade> <UF> <%>\nEx: /top 10 SP - /top 20 %")
+            return
+
+    # o ranking é calculado por quem atualiza as fontes, ou na primeira consulta de cada versão
+    with LatencyBudget(request_budget):
+        current = ranking.ranking()
+    movers = current.top(count, kind, uf) if current and current.base_date else []
+    if not movers:
+        update.message.reply_text("Ranking ainda não disponível. Tente mais tarde")
+        return
+
+    title = "Maiores altas{} - {}".format(" (%)" if kind == ranking.RELATIVE else "",
+                                         br_ufs[uf]["name"] if uf else "Brasil")
+    lines = ["*{}*".format(title),
+             "brasil.io: {} em relação a {}".format(_format_date(current.date), _format_date(current.base_date))]
+    for i, mover in enumerate(movers, 1):
+        lines.append("{}. {}/{}: +{:d} ({:+.1%})".format(i, mover.name, mover.uf, mover.increase, mover.ratio))
+    update.message.reply_markdown("\n".join(lines))
+
+
 def unknown(update, context):
     update.message.reply_text("Não entendi esse comando")
 
 
+def _notify(bot, corona, job_context):
+    """Envia ao chat do job os dados da região se houver mudança desde a versão que ele já recebeu"""
+    region = job_context["region"]
+    changelog.record("brasil_io", region, corona)
+    if corona.last_date:
+        # jobs gravados antes do changelog guardavam os últimos valores em "last"
+        job_context.pop("last", None)
+        version, changes = changelog.changes("brasil_io", region, job_context.get("version"))
+        if sum(changes) > 0 or not job_context.get("new", True):
+            description = "Região: *{}*\n{}".format(region, corona.get_description(changes))
+            missed = changelog.replay("brasil_io", region, job_context.get("version"))
+            if job_context.get("version") and len(missed) > 1:
+                # o chat perdeu mais de uma atualização (ex.: bot fora do ar), mostra cada uma
+                description += "\nAtualizações desde a última mensagem:\n" + "\n".join(
+                    "{}: +{:d} confirmados, +{:d} óbitos".format(date.strftime("%d-%m %H:%M"), delta[0], delta[1])
+                    for _, date, delta in missed)
+            bot.send_message(chat_id=job_context["chat_id"],
+                             text=description,
+                             parse_mode=ParseMode.MARKDOWN)
+        job_context["version"] = version
+
+
 def on_change_notifier(context):
     region = context.job.context["region"]
     sources = [BrasilIOData(region)]
     for corona in sources:
         corona.refresh()
-        if corona.last_date:
-            last = context.job.context["last"]
-            if last and sum(last) > 0:
-                changes = [i - j for i, j in zip(corona.get_data(), last)]
-            else:
-                changes = [0, 0, 0]
-            if sum(changes) > 0 or not context.job.context.get("new", True):
-                description = "Região: *{}*\n{}".format(region, corona.get_description(changes))
-                context.bot.send_message(chat_id=context.job.context["chat_id"],
-                                         text=description,
-                                         parse_mode=ParseMode.MARKDOWN)
-            context.job.context["last"] = corona.get_data()
+        _notify(context.bot, corona, context.job.context)
 
 
-def refresh_data(context):
-    WorldOMeterData.load()
-    OMSData.load()
-    BrasilIOData.load()
+def on_group_notifier(context):
+    """Atualiza a região uma vez e notifica todos os chats do grupo"""
+    group = context.job.context
+    corona = BrasilIOData(group.region)
+    corona.refresh()
+    for member in group.members:
+        try:
+            _notify(context.bot, corona, member.context)
+        except TelegramError as e:
+            logger.warning('Notify chat "%s" failed: %s', member.context["chat_id"], e)
 
+
+def refresh_data(context):
+    # os dados são atualizados em segundo plano pelo gerenciador de fontes
     job_context = context.job.context
 
     # busca atualizações de dados nos data sources para informar no canal
     # e para guardar na tabela de casos, se o banco estiver ativo
     region = job_context["region"]
-    sources = [WorldOMeterData(region), BrasilIOData(region)]
-    for corona in sources:
+    sources = {"world": WorldOMeterData(region), "brasil_io": BrasilIOData(region)}
+    for name, corona in sources.items():
         corona.refresh()
+        version = changelog.record(name, region, corona)
         if corona.last_date:
-            corona_data = corona.get_data()
-            if corona.data_source not in job_context:
-                job_context[corona.data_source] = {"last": corona_data}
+            if name not in job_context:
+                job_context[name] = version
             else:
-                last = job_context[corona.data_source]["last"]
-                changes = [i - j for i, j in zip(corona_data, last)]
+                _, changes = changelog.changes(name, region, job_context[name])
                 if sum(changes) > 0:
-                    job_context[corona.data_source]["last"] = corona_data
+                    job_context[name] = version
+                    corona_data = corona.get_data()
                     if job_context["chat_id"]:
                         context.bot.send_message(job_context["chat_id"],
                                                  text=corona.get_description(changes),
@@ -315,11 +373,52 @@ def refresh_data(context):
                         repo.save()
 
 
-if use_db:
-    logger.addHandler(DBLogHandler())
-    _jobs = JobsDBInfo()
-else:
-    _jobs = JobsInfo("logs/jobs.pickle")
+def send_digest(context):
+    """Envia o resumo ao canal uma vez por versão dos dados do brasil.io"""
+    job_context = context.job.context
+    version = snapshot.version("brasil_io")
+    if not version or version == job_context.get("version"):
+        return
+    try:
+        images, totals = digest.build(job_context.get("totals"))
+    except TimeoutError:
+        logger.warning("Digest render timeout, version %d", version)
+        return
+    if not images:
+        return
+    caption = "Resumo brasil.io - versão {}".format(version)
+    # grupos já enviados desta versão, para não repetir os álbuns após uma falha no envio
+    progress = job_context.get("progress")
+    sent = progress[1] if progress and progress[0] == version else 0
+    for i, group in enumerate(digest.media_groups(images)):
+        if i < sent:
+            continue
+        group_caption = caption if i == 0 else None
+        try:
+            if len(group) == 1:
+                context.bot.send_photo(job_context["chat_id"], photo=group[0], caption=group_caption)
+            else:
+                context.bot.send_media_group(job_context["chat_id"], media=digest.album(group, group_caption))
+        except TelegramError as e:
+            logger.warning("Digest group %d not sent, version %d: %s", i, version, e)
+            return
+        job_context["progress"] = (version, i + 1)
+    job_context["version"] = version
+    job_context["totals"] = totals
+
+
+def init_jobs(partition=None):
+    """Cria a lista de jobs do processo, com partition=(índice, total) apenas os chats da partição"""
+    global _jobs
+    if use_db:
+        _jobs = JobsDBInfo(partition)
+    else:
+        index, count = partition or (0, 1)
+        _jobs = JobsInfo(JobsInfo.part_name(jobs_file, index, count), partition)
+
+
+jobs_file = "logs/jobs.pickle"
+_jobs = None
 
 
 def set_timer(update, context):
@@ -337,9 +436,8 @@ def set_timer(update, context):
         # Add job to queue
         job = context.job_queue.run_repeating(on_change_notifier, minutes * 60, first=5,
                                               context={"chat_id": str(chat_id), "region": region,
-                                                       "new": only_new, "last": [0, 0, 0]})
+                                                       "new": only_new, "version": 0})
         _jobs.push(str(chat_id), job)
-        _jobs.save()
 
         update.message.reply_text('Monitoramento ativado!')
 
@@ -358,46 +456,169 @@ def unset_timer(update, context):
 
     job = _jobs.pop(chat_id)
     job.schedule_removal()
-    _jobs.save()
 
     update.message.reply_text('Monitoramento desativado')
 
 
-def main():
-    """Start the bot."""
-    # Certifique-se que exista uma variavel de ambiente com o nome TELEGRAM_TOKEN
-    # setada com o token do seu bot
-    updater = Updater(os.environ.get("TELEGRAM_TOKEN", "Get token on bot father!"), use_context=True)
+def _send_profile(bot, chat_id, seconds):
+    result = profiler.profile(seconds)
+    if not result:
+        bot.send_message(chat_id, "Já existe um profiling em andamento")
+        return
+    bot.send_message(chat_id, "```\n{}\n```".format(result.top(25)[:4000]), parse_mode=ParseMode.MARKDOWN)
+    document = io.BytesIO(result.collapsed().encode("utf-8"))
+    document.name = "profile_{}.collapsed".format(datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+    bot.send_document(chat_id, document=document, caption="Pilhas colapsadas (flamegraph.pl / speedscope)")
 
-    dp = updater.dispatcher
 
+def profile(update, context):
+    """Comando administrativo: executa o profiling de todas as threads por N segundos"""
+    if not admin_id or update.effective_user.id != admin_id:
+        unknown(update, context)
+        return
+    logger.info('Arrive /profile command "%s"', _log_message_data(update.effective_message))
+    try:
+        seconds = min(int(context.args[0]) if context.args else 30, profiler.max_seconds)
+    except ValueError:
+        update.message.reply_text("Use: /profile <segundos>")
+        return
+    update.message.reply_text("Profiling por {} segundos".format(seconds))
+    # o profiling roda em outra thread para não bloquear o dispatcher
+    threading.Thread(target=_send_profile, args=(context.bot, update.message.chat_id, seconds),
+                     name="profile", daemon=True).start()
+
+
+def _on_profile_signal(signum, frame):
+    """Executa o profiling ao receber SIGUSR1 e grava o resultado na pasta logs"""
+    seconds = int(os.environ.get("PROFILE_SECONDS", "30"))
+    threading.Thread(target=profiler.profile_to_files, args=(seconds,), name="profile", daemon=True).start()
+
+
+def add_handlers(dp):
+    """Registra os comandos do bot no dispatcher"""
     dp.add_handler(CommandHandler("start", start))
     dp.add_handler(CommandHandler("help", help))
     dp.add_handler(CommandHandler("stats", stats))
     dp.add_handler(CommandHandler("chart", chart))
+    dp.add_handler(CommandHandler("top", top))
     dp.add_handler(CommandHandler("listen", set_timer, pass_args=True, pass_job_queue=True))
     dp.add_handler(CommandHandler("mute", unset_timer))
+    dp.add_handler(CommandHandler("profile", profile))
     dp.add_handler(MessageHandler(Filters.text & ~Filters.update.channel_post, general))
     dp.add_handler(InlineQueryHandler(inline_query))
     dp.add_handler(MessageHandler(Filters.command, unknown))
 
-    # job para atualizar os dados das fontes e atualizar o canal caso haja novos casos
+    # log all errors
+    dp.add_error_handler(error)
+
+
+def _register_warmers():
+    """Prepara as respostas a partir do texto das mensagens, como o botlog registra"""
+    prewarm.register("/stats", lambda text: _shared_describe("stats", None))
+    prewarm.register("text", lambda text: _shared_describe("general", text))
+    prewarm.register("/chart", lambda text: _chart_data(" ".join(text.split()[1:]).split(",")))
+
+
+def start_sources(follow=False, track=True):
+    """Carrega os dados do último snapshot para responder antes da primeira atualização
+    e atualiza cada fonte em segundo plano, com o intervalo REFRESH_TIME_<FONTE> ou REFRESH_TIME.
+    Com follow=True apenas lê os snapshots publicados pelo processo que atualiza as fontes,
+    inclusive os das tendências do analytics e do ranking do /top, que só são calculados
+    pelo processo que atualiza.
+    Com track=True cada nova versão das fontes é registrada no changelog das regiões dos jobs
+    e as respostas mais pedidas são preparadas.
+    Os listeners também são chamados para as fontes restauradas do snapshot na inicialização
+    """
+    refresh_time = int(os.environ.get("REFRESH_TIME", "600"))
+    analytics.restore()
+    ranking.restore()
+    if not follow:
+        manager.add_listener(analytics.update)
+        manager.add_listener(ranking.update)
+    if track:
+        changelog.load(_jobs.partition)
+        manager.add_listener(changelog.update)
+        _register_warmers()
+        prewarm.partition = _jobs.partition
+        manager.add_listener(prewarm.update)
+    for name, source in _sources.items():
+        restored = source.restore()
+        changelog.register(name, source)
+        if follow:
+            manager.follow(name, source.restore, snapshot_poll)
+        else:
+            interval = int(os.environ.get("REFRESH_TIME_{}".format(name.upper()), refresh_time))
+            manager.register(name, source.load, interval, breaker.get(source().data_source))
+        if restored:
+            manager.restored(name)
+    if follow:
+        manager.follow("trends", analytics.restore, snapshot_poll)
+        manager.follow("ranking", ranking.restore, snapshot_poll)
+    manager.start()
+
+
+def start_channel_job(job_queue):
+    """job para atualizar o canal caso haja novos casos"""
     refresh_time = int(os.environ.get("REFRESH_TIME", "600"))
-    dp.job_queue.run_repeating(refresh_data, refresh_time, first=5, context={"chat_id": channel_id, "region": "BR"})
+    job_queue.run_repeating(refresh_data, refresh_time, first=5, context={"chat_id": channel_id, "region": "BR"})
+    digest_time = int(os.environ.get("DIGEST_TIME", "0"))
+    if digest_time and channel_id:
+        job_queue.run_repeating(send_digest, digest_time, first=60, context={"chat_id": channel_id})
 
-    # carrega a lista de jobs que estavam programados
 
+def _first_run(interval):
+    """Primeira execução sorteada dentro do intervalo, para que os jobs restaurados não disparem juntos"""
+    return random.uniform(5, max(interval, 5))
+
+
+def restore_jobs(job_queue):
+    """carrega a lista de jobs que estavam programados
+    Os jobs com a mesma região e intervalo compartilham um único timer
+    """
+    groups = {}
     jobs = _jobs.load()
     for key, data in jobs.items():
+        interval = data.get("interval", 300)
+        context = data.get("context")
         if data.get("repeat", True):
-            _jobs.push(key, dp.job_queue.run_repeating(on_change_notifier,
-                                                       data.get("interval", 300), context=data.get("context")))
+            group_key = (context["region"], interval)
+            if group_key not in groups:
+                groups[group_key] = JobGroup(context["region"], interval)
+            _jobs.restore(key, groups[group_key].add(context))
         else:
-            _jobs.push(key, dp.job_queue.run_once(on_change_notifier,
-                                                  data.get("interval", 300), context=data.get("context")))
+            _jobs.restore(key, job_queue.run_once(on_change_notifier, interval, context=context))
+    for group in groups.values():
+        group.job = job_queue.run_repeating(on_group_notifier, group.interval,
+                                            first=_first_run(group.interval), context=group)
+    logger.info("Restored %d jobs in %d timers", len(jobs), len(groups))
 
-    # log all errors
-    dp.add_error_handler(error)
+
+def main():
+    """Start the bot."""
+    setup_logging()
+    init_jobs()
+    # Certifique-se que exista uma variavel de ambiente com o nome TELEGRAM_TOKEN
+    # setada com o token do seu bot
+    updater = Updater(os.environ.get("TELEGRAM_TOKEN", "Get token on bot father!"), use_context=True)
+
+    dp = updater.dispatcher
+    add_handlers(dp)
+
+    if metrics_port:
+        metrics.start_server(metrics_port)
+    if api_port:
+        api.start_server(api_port, _sources, api_address)
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, _on_profile_signal)
+
+    start_sources()
+    start_channel_job(dp.job_queue)
+
+    # junta os jobs gravados por cada worker, caso o bot tenha rodado com WORKERS > 1
+    if not use_db:
+        JobsInfo.split(jobs_file, 1)
+    restore_jobs(dp.job_queue)
 
     # Inicia o Bot no modo polling
     updater.start_polling()
@@ -405,4 +626,7 @@ def main():
     # Roda até receber um Ctrl-C
     updater.idle()
 
+    manager.stop()
+    render.shutdown()
     _jobs.save()
+    changelog.save()
@@ -2,12 +2,12 @@
 
 import copy
 import json
-import re
 
-from dateutil import parser
 from datetime import datetime
 
-from dasbot.corona import CoronaData, http_get, case_less_eq
+from dasbot import snapshot, singleflight, regions, history
+from dasbot.sources import manager
+from dasbot.corona import CoronaData, http_get, parse_date
 
 
 _raw_data = []
@@ -24,27 +24,37 @@ class BrasilIOData(CoronaData):
         self._data_source = "brasil.io"
         self._region = region if region else "BR"
         self._data = {}
-        self._match_complete = re.findall(r"([A-zÀ-ú\s]+)[-:\s]*([A-Z]{2})", self._region)
-        self._match_uf = re.findall(r"^[A-Z]{2}$", self._region)
 
     def get_data(self):
         return [self._data.get("confirmed", 0), self._data.get("deaths", 0), 0]
 
+    def trend(self):
+        # as tendências são calculadas para o Brasil e as UFs
+        from dasbot import analytics
+
+        return analytics.trend(self.place) if self._last_date else None
+
+    def average(self):
+        from dasbot import analytics
+
+        return analytics.average(self.place) if self._last_date else None
+
     def get_series(self):
         series = []
-        if self._region != "BR":
-            for case in self._raw_data:
-                if self._match_region(case):
-                    region_code = case.get("city_ibge_code", 0)
-                    series = BrasilIOData.load_region_series(region_code)
-                    break
-        else:
-            series = BrasilIOData.load_series()
+        place = self.place
+        # as séries têm muitas páginas e são lentas: usam um circuito próprio para que os
+        # pedidos de /chart não abram o circuito da carga principal do brasil.io
+        circuit = "{}.series".format(self._data_source)
+        if place is regions.BRAZIL:
+            series = self._fetch(BrasilIOData.load_series, circuit=circuit) or []
+        elif place:
+            series = self._local_series(place.code) or \
+                self._fetch(BrasilIOData.load_region_series, place.code, circuit=circuit) or []
 
         cases = {}
         for case in series:
             try:
-                date = parser.parse(case["date"])
+                date = parse_date(case["date"])
                 if date <= datetime.today():
                     cases[date] = cases.get(date, 0) + (case.get("confirmed", 0) or 0)
             except ValueError:
@@ -58,16 +68,19 @@ class BrasilIOData(CoronaData):
 
         return result
 
+    def _local_series(self, code):
+        """Série guardada localmente, se já chegar à data da região no cache"""
+        current = next((rec["date"] for rec in self._raw_data if rec.get("city_ibge_code") == code), None)
+        if current is None:
+            return None
+        return history.region_series("brasil_io", code, current)
+
     def _match_region(self, rec):
-        if self._region == "BR":
+        place = self.place
+        if place is regions.BRAZIL:
             return rec["city"] is None
-        elif self._match_uf:
-            return rec["city"] is None and rec["state"] == self._match_uf[0]
-        elif self._match_complete:
-            return rec["state"] == self._match_complete[0][1] and \
-                   case_less_eq(rec["city"], self._match_complete[0][0].strip())
-        else:
-            return rec["place_type"] == "city" and case_less_eq(rec["city"], self._region)
+        # as linhas dos estados trazem o código da UF em city_ibge_code
+        return place is not None and rec.get("city_ibge_code") == place.code
 
     def _update_stats(self):
         self._data = {}
@@ -76,18 +89,37 @@ class BrasilIOData(CoronaData):
                 for k in BrasilIOData.categories():
                     self._data[k] = case.get(k, 0) + self._data.get(k, 0)
         if self._data:
-            self._last_date = parser.parse(self._raw_data[0]["date"])
+            self._last_date = parse_date(self._raw_data[0]["date"])
 
     def _load_data(self):
-        if not _raw_data:
-            BrasilIOData.load()
+        self._count_cache(bool(_raw_data))
+        if not _raw_data and not manager.is_managed("brasil_io"):
+            self._fetch(BrasilIOData.load)
         self._raw_data = copy.deepcopy(_raw_data)
         if self._raw_data:
             return True
         return False
 
     @staticmethod
+    def rollup():
+        """Totais do país e de cada UF em uma única passagem pelo cache
+        Retorna ({região: [confirmados, mortes, recuperados]}, data dos dados)
+        """
+        data = _raw_data
+        totals = {}
+        for case in data:
+            if case["city"] is None:
+                for region in ("BR", case["state"]):
+                    values = totals.setdefault(region, [0, 0, 0])
+                    values[0] += case.get("confirmed", 0) or 0
+                    values[1] += case.get("deaths", 0) or 0
+        last_date = parse_date(data[0]["date"]) if totals else None
+        return totals, last_date
+
+    @staticmethod
+    @singleflight.shared("brasil_io.load_region_series")
     def load_region_series(region_code):
+        """Todas as páginas da série do município ou None se alguma página falhou"""
         result_data = []
         next_page = "https://brasil.io/api/dataset/covid19/caso/data?city_ibge_code={}".format(region_code)
         while next_page:
@@ -97,11 +129,14 @@ class BrasilIOData(CoronaData):
                 result_data.extend(data["results"])
                 next_page = data.get("next")
             else:
-                break
+                return None
+        history.record("brasil_io", result_data)
         return result_data
 
     @staticmethod
+    @singleflight.shared("brasil_io.load_series")
     def load_series():
+        """Todas as páginas da série dos estados ou None se alguma página falhou"""
         result_data = []
         next_page = "https://brasil.io/api/dataset/covid19/caso/data?place_type=state"
         while next_page:
@@ -111,11 +146,13 @@ class BrasilIOData(CoronaData):
                 result_data.extend(data["results"])
                 next_page = data.get("next")
             else:
-                break
+                return None
         return result_data
 
     @staticmethod
+    @singleflight.shared("brasil_io.load")
     def load():
+        """Carrega todas as páginas e só substitui o cache se todas foram lidas"""
         global _raw_data
         raw_data = []
         next_page = "https://brasil.io/api/dataset/covid19/caso/data?is_last=True"
@@ -126,5 +163,21 @@ class BrasilIOData(CoronaData):
                 raw_data.extend(data["results"])
                 next_page = data.get("next")
             else:
-                break
-        _raw_data = raw_data
+                return False
+        if raw_data:
+            _raw_data = raw_data
+            regions.update(raw_data)
+            snapshot.save("brasil_io", raw_data)
+            return True
+        return False
+
+    @staticmethod
+    def restore():
+        """Carrega os dados do snapshot se ele for mais novo que o cache, retorna True se carregou"""
+        global _raw_data
+        data = snapshot.load_if_newer("brasil_io")
+        if data:
+            _raw_data = data
+            regions.update(data)
+            return True
+        return False
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo breaker
+Circuit breaker por fonte de dados e orçamento de latência por requisição
+
+Uma fonte com muitos erros ou respostas lentas fica fora do ar por um período
+(cooldown) e as cargas feitas durante um comando não esperam mais do que o
+tempo restante do orçamento da requisição.
+"""
+
+import os
+import time
+import logging
+import threading
+
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+cooldown = int(os.environ.get("BREAKER_COOLDOWN", "60"))
+# chamadas mais lentas do que isso contam como falha
+slow_call = float(os.environ.get("BREAKER_SLOW_CALL", "5"))
+
+_budget = threading.local()
+_breakers = {}
+_lock = threading.Lock()
+
+
+class CircuitBreaker(object):
+    """Abre o circuito quando a taxa de erro das últimas chamadas passa do limite
+    Depois do cooldown uma chamada de teste é liberada (meio aberto): se ela falhar
+    o circuito abre novamente, se tiver sucesso ele fecha
+    """
+
+    def __init__(self, name, window=20, min_calls=5, error_rate=0.5):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self._calls = deque(maxlen=window)
+        self._open_until = 0
+        self._half_open = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._half_open:
+            return "half-open"
+        return "open" if time.monotonic() < self._open_until else "closed"
+
+    def allow(self):
+        with self._lock:
+            if self._half_open:
+                return False
+            if self._open_until and time.monotonic() >= self._open_until:
+                self._open_until = 0
+                self._half_open = True
+                return True
+            return not self._open_until
+
+    def record(self, ok, elapsed):
+        with self._lock:
+            ok = ok and elapsed <= slow_call
+            if self._half_open:
+                self._half_open = False
+                if not ok:
+                    self._open()
+                return
+            self._calls.append(ok)
+            if len(self._calls) >= self.min_calls:
+                errors = self._calls.count(False)
+                if errors / len(self._calls) >= self.error_rate:
+                    self._open()
+
+    def _open(self):
+        self._open_until = time.monotonic() + cooldown
+        self._calls.clear()
+        logger.warning('Circuit "%s" open for %ds', self.name, cooldown)
+
+
+def get(name):
+    """Retorna o circuit breaker da fonte, criando na primeira chamada"""
+    with _lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+class LatencyBudget(object):
+    """Limita o tempo total de espera pelas fontes durante uma requisição
+
+    with LatencyBudget(10):
+        corona.refresh()
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._deadline = None
+        self._previous = None
+
+    def remaining(self):
+        return self._deadline - time.monotonic()
+
+    def __enter__(self):
+        self._deadline = time.monotonic() + self.seconds
+        self._previous = getattr(_budget, "current", None)
+        _budget.current = self
+        return self
+
+    def __exit__(self, *args):
+        _budget.current = self._previous
+
+
+def remaining_budget():
+    """Tempo restante do orçamento da requisição atual ou None se não houver orçamento"""
+    current = getattr(_budget, "current", None)
+    return current.remaining() if current else None
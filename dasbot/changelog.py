@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo changelog
+Histórico das mudanças dos dados por fonte e região
+
+A cada nova versão do snapshot de uma fonte, as regiões acompanhadas (as
+regiões dos jobs do /listen e do canal) ganham uma entrada com os valores e
+a diferença para a entrada anterior. Cada chat guarda apenas a última versão
+que recebeu: as mudanças desde essa versão são calculadas em O(1) e as
+versões perdidas podem ser repassadas com replay().
+"""
+
+import os
+import bisect
+import logging
+import threading
+
+from dasbot import snapshot
+
+
+logger = logging.getLogger(__name__)
+
+# quantidade máxima de entradas guardadas por região
+max_entries = int(os.environ.get("CHANGELOG_SIZE", "500"))
+
+_factories = {}
+_logs = {}
+_lock = threading.Lock()
+_store = "changelog"
+
+
+class RegionLog(object):
+    """Entradas (data, valores, diferença) de uma região, indexadas pela versão da fonte"""
+
+    def __init__(self):
+        self.versions = []
+        self.entries = {}
+
+    @property
+    def version(self):
+        return self.versions[-1] if self.versions else 0
+
+    def record(self, version, date, values):
+        """Adiciona uma entrada se a versão é nova e os valores mudaram, retorna True se adicionou"""
+        values = list(values)
+        if self.versions:
+            if version <= self.version:
+                return False
+            last = self.entries[self.version][1]
+            if values == last:
+                return False
+            delta = [i - j for i, j in zip(values, last)]
+        else:
+            delta = [0] * len(values)
+        self.versions.append(version)
+        self.entries[version] = (date, values, delta)
+        if len(self.versions) > max_entries:
+            for old in self.versions[:-max_entries]:
+                del self.entries[old]
+            self.versions = self.versions[-max_entries:]
+        return True
+
+    def _entry(self, version):
+        entry = self.entries.get(version)
+        if entry is None:
+            # versão sem entrada própria ou já descartada: usa a entrada anterior mais próxima
+            i = bisect.bisect_right(self.versions, version) - 1
+            entry = self.entries[self.versions[max(i, 0)]]
+        return entry
+
+    def changes(self, version):
+        """Diferença entre os valores atuais e os valores na versão informada"""
+        if not self.versions or not version:
+            return [0, 0, 0]
+        base = self._entry(version)[1]
+        current = self.entries[self.version][1]
+        return [i - j for i, j in zip(current, base)]
+
+    def replay(self, version):
+        """Entradas (versão, data, diferença) posteriores à versão informada"""
+        i = bisect.bisect_right(self.versions, version or 0)
+        return [(v, self.entries[v][0], self.entries[v][2]) for v in self.versions[i:]]
+
+
+def register(name, factory):
+    """Registra a classe da fonte usada para calcular os dados das regiões acompanhadas"""
+    _factories[name] = factory
+
+
+def _get(name, region):
+    key = (name, region)
+    if key not in _logs:
+        _logs[key] = RegionLog()
+    return _logs[key]
+
+
+def record(name, region, corona):
+    """Registra os dados já atualizados da fonte para a região e retorna a versão mais recente"""
+    with _lock:
+        log = _get(name, region)
+        if corona.last_date:
+            log.record(snapshot.version(name), corona.last_date, corona.get_data())
+        return log.version
+
+
+def changes(name, region, version):
+    """Retorna (versão atual, diferença desde a versão informada)"""
+    with _lock:
+        log = _get(name, region)
+        return log.version, log.changes(version)
+
+
+def replay(name, region, version):
+    """Entradas (versão, data, diferença) da região posteriores à versão informada"""
+    with _lock:
+        return _get(name, region).replay(version)
+
+
+def update(name):
+    """Registra uma entrada para cada região acompanhada da fonte, chamado a cada nova versão"""
+    factory = _factories.get(name)
+    if not factory:
+        return
+    with _lock:
+        regions = [region for source, region in _logs if source == name]
+    for region in regions:
+        corona = factory(region)
+        corona.refresh()
+        record(name, region, corona)
+    save()
+
+
+def save():
+    """Grava o histórico no snapshot, para as versões perdidas serem repassadas após um restart"""
+    with _lock:
+        data = {key: (log.versions, log.entries) for key, log in _logs.items()}
+    snapshot.save(_store, data)
+
+
+def load(partition=None):
+    """Carrega o histórico gravado; com partition=(índice, total) usa o arquivo do worker"""
+    global _store
+    _store = "changelog" if not partition else "changelog.{}-{}".format(*partition)
+    data = snapshot.load(_store)
+    if not data:
+        return
+    with _lock:
+        for key, (versions, entries) in data.items():
+            log = RegionLog()
+            log.versions = versions
+            log.entries = entries
+            _logs[key] = log
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo cluster
+Executa o bot em vários processos quando WORKERS > 1
+
+- fetcher: um processo que atualiza as fontes e publica os snapshots (SNAPSHOT_DIR)
+- workers: N processos com os handlers, que apenas leem os snapshots publicados.
+  Cada worker atende os chats da sua partição (crc32 do chat_id) e é dono dos
+  jobs do /listen desses chats
+- o processo principal recebe os updates do Telegram e distribui entre os workers
+
+Assim a renderização dos gráficos usa todos os núcleos e as fontes são
+consultadas uma única vez, independente da quantidade de workers.
+"""
+
+import os
+import json
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from telegram.ext import Updater
+
+from dasbot import bot, metrics, render, api
+from dasbot.jobs import shard
+from dasbot.sources import manager
+
+
+logger = logging.getLogger(__name__)
+
+workers = int(os.environ.get("WORKERS", "1"))
+token = os.environ.get("TELEGRAM_TOKEN", "Get token on bot father!")
+
+
+def route(update, count):
+    """Worker que deve tratar o update: pelo chat ou, nas consultas inline, pelo usuário"""
+    if update.effective_chat:
+        key = update.effective_chat.id
+    elif update.effective_user:
+        key = update.effective_user.id
+    else:
+        key = update.update_id
+    return shard(key, count)
+
+
+def _fetcher():
+    """Processo que atualiza as fontes e grava os snapshots"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    bot.setup_logging()
+    bot.start_sources(track=False)
+    threading.Event().wait()
+
+
+def _worker(index, count, updates):
+    """Processo com os handlers do bot para os chats da partição index"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    bot.setup_logging()
+    bot.init_jobs((index, count))
+
+    updater = Updater(token, use_context=True)
+    dp = updater.dispatcher
+    bot.add_handlers(dp)
+
+    if bot.metrics_port:
+        metrics.start_server(bot.metrics_port + index + 1)
+    # a API é atendida apenas pelo primeiro worker
+    if bot.api_port and index == 0:
+        api.start_server(bot.api_port, bot._sources, bot.api_address)
+
+    bot.start_sources(follow=True)
+    # apenas um worker atualiza o canal
+    if index == shard(bot.channel_id, count):
+        bot.start_channel_job(dp.job_queue)
+    bot.restore_jobs(dp.job_queue)
+
+    updater.job_queue.start()
+    dispatcher = threading.Thread(target=dp.start, name="dispatcher", daemon=True)
+    dispatcher.start()
+    logger.info("Worker %d/%d started", index, count)
+
+    while True:
+        data = updates.get()
+        if data is None:
+            break
+        dp.update_queue.put(Update.de_json(json.loads(data), updater.bot))
+
+    dp.stop()
+    updater.job_queue.stop()
+    manager.stop()
+    render.shutdown()
+    bot._jobs.save()
+    bot.changelog.save()
+
+
+def _poll(telegram, queues, stop):
+    """Busca os updates no Telegram e envia cada um para a fila do seu worker"""
+    offset = None
+    wait = 1
+    while not stop.is_set():
+        try:
+            updates = telegram.get_updates(offset=offset, timeout=20)
+            wait = 1
+        except TelegramError as e:
+            logger.warning("Error getting updates: %s", e)
+            stop.wait(wait)
+            wait = min(wait * 2, 30)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            queues[route(update, len(queues))].put(update.to_json())
+
+
+def main(count=workers):
+    """Inicia o fetcher e os workers e distribui os updates até receber SIGTERM ou Ctrl-C"""
+    context = multiprocessing.get_context("spawn")
+    bot.setup_logging()
+    if not bot.use_db:
+        bot.JobsInfo.split(bot.jobs_file, count)
+
+    fetcher = context.Process(target=_fetcher, name="fetcher", daemon=True)
+    fetcher.start()
+    queues = [context.Queue() for _ in range(count)]
+    processes = [context.Process(target=_worker, args=(i, count, queues[i]), name="worker-{}".format(i))
+                 for i in range(count)]
+    for process in processes:
+        process.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    telegram = Bot(token)
+    telegram.delete_webhook()
+    poller = threading.Thread(target=_poll, args=(telegram, queues, stop), name="poller", daemon=True)
+    poller.start()
+    try:
+        while not stop.is_set() and all(p.is_alive() for p in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=20)
+        fetcher.terminate()
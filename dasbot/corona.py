@@ -7,16 +7,45 @@ Classes que fornecem dados sobre o corona virus
 """
 
 import io
+import os
+import math
+import time
+import socket
+import threading
 import unicodedata
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 
-from matplotlib.ticker import MaxNLocator
 from datetime import datetime
 from urllib.request import urlopen, Request
 from urllib.error import URLError
-from PIL import Image, ImageDraw, ImageFont
+from urllib.parse import urlparse
 
+from dasbot import breaker, metrics
+
+# matplotlib, PIL e dateutil são carregados apenas no primeiro uso,
+# para que o processo do bot inicie sem esperar por eles
+
+
+# tempo máximo de espera de uma requisição http fora de um orçamento de latência
+http_timeout = int(os.environ.get("HTTP_TIMEOUT", "30"))
+# pontos de cada linha dos gráficos, 0 usa um ponto a cada 2 pixels da largura da figura
+chart_points = int(os.environ.get("CHART_POINTS", "0"))
+
+CHART_DPI = 150
+
+_http_seconds = metrics.histogram("dasbot_http_request_seconds", "Tempo das requisições http", ("host",))
+_http_requests = metrics.counter("dasbot_http_requests_total", "Requisições http por resultado", ("host", "result"))
+_refresh_seconds = metrics.histogram("dasbot_refresh_seconds", "Tempo do refresh das fontes", ("source",))
+_load_data_seconds = metrics.histogram("dasbot_load_data_seconds", "Tempo do _load_data das fontes", ("source",))
+_update_stats_seconds = metrics.histogram("dasbot_update_stats_seconds", "Tempo do _update_stats das fontes",
+                                          ("source",))
+_cache_requests = metrics.counter("dasbot_cache_requests_total", "Leituras do cache das fontes", ("source", "result"))
+_render_seconds = metrics.histogram("dasbot_render_seconds", "Tempo de renderização das imagens", ("kind",))
+
+# o estado global do pyplot não pode ser usado por duas threads ao mesmo tempo
+_pyplot_lock = threading.Lock()
+_fonts = {}
+# região ainda não resolvida, None indica que o texto não foi reconhecido
+_UNSET = object()
 
 br_ufs = {
  'RO': {'uid': '11', 'name': 'Rondônia'},
@@ -60,6 +89,12 @@ def case_less_eq(left, right):
     return _normalize_case(left) == _normalize_case(right)
 
 
+def parse_date(text):
+    """Converte o texto em datetime usando o dateutil"""
+    from dateutil import parser
+    return parser.parse(text)
+
+
 def http_get(url, headers={}, expected=200):
     """return a request object from a url using http get
     """
@@ -68,11 +103,21 @@ def http_get(url, headers={}, expected=200):
         'Accept': 'text/html,application/xhtml+xml,application/xml,application/json;q=0.9,*/*;q=0.8'}
     hdr.update(headers)
 
+    host = urlparse(url).netloc
+    timeout = breaker.remaining_budget()
+    if timeout is not None and timeout <= 0:
+        _http_requests.inc(host, "skipped")
+        return None
+
     try:
-        req = Request(url, headers=hdr)
-        response = urlopen(req)
-        return response if response.getcode() == expected else None
-    except URLError:
+        with _http_seconds.time(host):
+            req = Request(url, headers=hdr)
+            response = urlopen(req, timeout=timeout or http_timeout)
+        ok = response.getcode() == expected
+        _http_requests.inc(host, "ok" if ok else "status")
+        return response if ok else None
+    except (URLError, socket.timeout, ConnectionError):
+        _http_requests.inc(host, "error")
         return None
 
 
@@ -85,6 +130,7 @@ class CoronaData(object):
         self._last_date = None
         self._data_source = ""
         self._region = ""
+        self._place = _UNSET
 
     @property
     def data_source(self):
@@ -112,6 +158,11 @@ class CoronaData(object):
             if data[0] > 0 and data[1] > 0:
                 death_rate = data[1] / data[0]
                 cases.append("📈 Letalidade: *{:2.1%}*".format(death_rate))
+            trend = self.trend()
+            if trend:
+                cases.append("📊 Média de 7 dias: *{:.0f}* casos novos por dia".format(trend.average))
+                if trend.growth is not None and math.isfinite(trend.doubling):
+                    cases.append("⏱ Dobra em *{:.0f}* dias ({:+.1%} ao dia)".format(trend.doubling, trend.growth))
             result = "{} em {}\n{}\n".format(self.data_source,
                                              self.last_date.strftime("%d-%m-%Y %H:%M"),
                                              "\n".join(cases))
@@ -127,9 +178,55 @@ class CoronaData(object):
     def region(self):
         return self._region
 
+    @property
+    def place(self):
+        """Região resolvida pelo módulo regions, com o código do IBGE, ou None"""
+        from dasbot import regions
+
+        if self._place is _UNSET:
+            self._place = regions.resolve(self._region)
+        return self._place
+
     def refresh(self):
-        if self._load_data():
-            self._update_stats()
+        with _refresh_seconds.time(self._data_source):
+            with _load_data_seconds.time(self._data_source):
+                loaded = self._load_data()
+            if loaded:
+                with _update_stats_seconds.time(self._data_source):
+                    self._update_stats()
+
+    def _count_cache(self, hit):
+        """Conta as leituras do cache global da fonte para a taxa de acerto"""
+        _cache_requests.inc(self._data_source, "hit" if hit else "miss")
+
+    def _fetch(self, loader, *args, circuit=None):
+        """Executa uma carga na fonte de dados, protegida pelo circuit breaker da fonte
+        (ou do circuito informado) e pelo orçamento de latência da requisição.
+        Retorna None se a fonte foi ignorada
+        """
+        circuit = breaker.get(circuit or self._data_source)
+        budget = breaker.remaining_budget()
+        if (budget is not None and budget <= 0) or not circuit.allow():
+            return None
+        start = time.monotonic()
+        try:
+            result = loader(*args)
+        except Exception:
+            circuit.record(False, time.monotonic() - start)
+            raise
+        # uma lista vazia é uma resposta válida, apenas None indica que a fonte falhou
+        circuit.record(result is not None, time.monotonic() - start)
+        return result
+
+    def trend(self):
+        """Implementado na subclasse para retornar as tendências da região (analytics.Trend) ou None"""
+        return None
+
+    def average(self):
+        """Implementado na subclasse para retornar a média de 7 dias dos casos novos já calculada
+        ({data: média}) ou None
+        """
+        return None
 
     def get_data(self):
         """Implementado na subclasse para retornar os dados em um array
@@ -167,6 +264,8 @@ class SeriesChart(object):
         for corona in args:
             self.series.append(corona.get_series())
             self.regions.append(corona.region)
+        # lida aqui porque o gráfico é desenhado em outro processo, sem as tendências em memória
+        self.average = args[0].average() if len(args) == 1 else None
 
     def validate(self):
         for series in self.series:
@@ -175,10 +274,35 @@ class SeriesChart(object):
         return True
 
     def image(self):
+        with _render_seconds.time("chart"):
+            return self._image()
+
+    def _image(self):
+        import matplotlib.pyplot as plt
+        from PIL import Image
+
+        with _pyplot_lock:
+            fig = plt.figure(figsize=(10, 5))
+            try:
+                file = self._plot(fig)
+            finally:
+                plt.close(fig)
+        image = Image.open(file)
+
+        bio = io.BytesIO()
+        bio.name = 'series.png'
+        image.save(bio, 'PNG')
+        bio.seek(0)
+        return bio
+
+    def _plot(self, fig):
+        import matplotlib.pyplot as plt
+        import matplotlib.dates as mdates
+        from matplotlib.ticker import MaxNLocator
+
         x_axis = []
         y_axis = {}
-
-        fig = plt.figure(figsize=(10, 5))
+        budget = chart_points or int(fig.get_figwidth() * CHART_DPI / 2)
 
         if len(self.series) == 1:
             categories = {
@@ -194,7 +318,7 @@ class SeriesChart(object):
                 for k in categories:
                     y_axis[k].append(values[k])
             for k, v in categories.items():
-                plt.plot(x_axis, y_axis[k], label=v)
+                plt.plot(*self._downsample(x_axis, y_axis[k], budget), label=v)
             plt.title("Contaminação pelo COVID-19 : {} - Fonte: {}".format(self.regions[0], self.source))
         else:
             dates = {}
@@ -213,7 +337,7 @@ class SeriesChart(object):
                             y_axis[i].append(y_axis[i][-1])
                         else:
                             y_axis[i].append(0)
-                plt.plot(x_axis, y_axis[i], label=self.regions[i])
+                plt.plot(*self._downsample(x_axis, y_axis[i], budget), label=self.regions[i])
             plt.title("COVID-19 : Confirmados - Fonte: {}".format(self.source))
 
         ax = plt.gca()
@@ -225,38 +349,123 @@ class SeriesChart(object):
 
         plt.xlabel('Data')
         plt.ylabel('Quantidade')
-        plt.legend()
+        # a média só aparece no Brasil e nas UFs, que têm as tendências calculadas
+        if self.average:
+            self._plot_average(ax, self.average, budget)
+        else:
+            plt.legend()
 
         file = io.BytesIO()
-        fig.savefig(file, bbox_inches='tight', dpi=150, format="png")
-        image = Image.open(file)
+        fig.savefig(file, bbox_inches='tight', dpi=CHART_DPI, format="png")
+        return file
 
-        bio = io.BytesIO()
-        bio.name = 'series.png'
-        image.save(bio, 'PNG')
+    @staticmethod
+    def _downsample(x_axis, values, budget):
+        """Reduz a linha a no máximo budget pontos com o LTTB, para que o tempo de desenho
+        e o tamanho do png não cresçam com o tamanho do histórico
+        """
+        if len(x_axis) <= budget:
+            return x_axis, values
+        from dasbot import analytics
+
+        indices = analytics.lttb([date.toordinal() for date in x_axis], values, budget)
+        return [x_axis[i] for i in indices], [values[i] for i in indices]
+
+    @staticmethod
+    def _plot_average(ax, average, budget):
+        """Média de 7 dias dos casos novos ({data: média}) em um segundo eixo"""
+        from matplotlib.ticker import MaxNLocator
+
+        x_axis = [datetime.combine(date, datetime.min.time()) for date in sorted(average)]
+        values = [average[date] for date in sorted(average)]
+        twin = ax.twinx()
+        twin.plot(*SeriesChart._downsample(x_axis, values, budget), color="tab:orange", linewidth=1,
+                  label="Casos novos (média de 7 dias)")
+        twin.set_ylabel('Casos novos por dia')
+        twin.yaxis.set_major_locator(MaxNLocator(integer=True))
+        handles, labels = ax.get_legend_handles_labels()
+        twin_handles, twin_labels = twin.get_legend_handles_labels()
+        ax.legend(handles + twin_handles, labels + twin_labels, loc="upper left")
+
+
+class MoversChart(object):
+
+    def __init__(self, title, movers):
+        """movers é uma lista de (região, valor) já ordenada, do maior para o menor"""
+        self.title = title
+        self.movers = movers
+
+    def validate(self):
+        return bool(self.movers)
+
+    def image(self):
+        with _render_seconds.time("movers"):
+            return self._image()
+
+    def _image(self):
+        import matplotlib.pyplot as plt
+
+        with _pyplot_lock:
+            fig = plt.figure(figsize=(10, 5))
+            try:
+                labels = [label for label, _ in reversed(self.movers)]
+                values = [value for _, value in reversed(self.movers)]
+                ax = fig.gca()
+                bars = ax.barh(labels, values, color="#3100c4")
+                for bar, value in zip(bars, values):
+                    ax.text(bar.get_width(), bar.get_y() + bar.get_height() / 2, " {:d}".format(value),
+                            va="center")
+                ax.set_title(self.title)
+                ax.set_xlabel("Quantidade")
+                ax.xaxis.get_major_formatter().set_scientific(False)
+
+                bio = io.BytesIO()
+                bio.name = 'series.png'
+                fig.savefig(bio, bbox_inches='tight', dpi=150, format="png")
+            finally:
+                plt.close(fig)
         bio.seek(0)
         return bio
 
 
+def _font(size):
+    """Fontes do painel, carregadas uma vez por processo"""
+    from PIL import ImageFont
+
+    if size not in _fonts:
+        _fonts[size] = ImageFont.truetype('res/RobotoMono-Bold.ttf', size=size)
+    return _fonts[size]
+
+
 class DataPanel(object):
 
     def __init__(self, *args):
-        self._series = args
-        self._font = ImageFont.truetype('res/RobotoMono-Bold.ttf', size=18)
-        self._font_lg = ImageFont.truetype('res/RobotoMono-Bold.ttf', size=24)
-        self._font_sm = ImageFont.truetype('res/RobotoMono-Bold.ttf', size=14)
+        # guarda apenas os valores das fontes, para que o painel possa ser enviado para outro processo
+        self._region = args[0].region if args else ""
+        self._rows = [(corona.data_source, corona.get_data(), corona.last_date) for corona in args]
+        self._font = None
+        self._font_lg = None
+        self._font_sm = None
+
+    @classmethod
+    def from_rows(cls, region, rows):
+        """Cria o painel a partir de linhas (fonte, [confirmados, mortes, recuperados], data) já calculadas"""
+        panel = cls()
+        panel._region = region
+        panel._rows = rows
+        return panel
 
     def _draw_header(self, draw):
         header = ["{:^10}".format(h) for h in ["Confirmados", "Mortes", "Recuperados"]]
         header.insert(0, "{:16}".format("Fonte"))
         draw.text((70, 100), "".join(header), fill="rgb(49,0,196)", font=self._font_lg)
 
-    def _draw_data(self, draw, corona, row):
-        draw.text((70, 165 + 72 * row), "{:20}".format(corona.data_source), fill="rgb(0,0,0)", font=self._font)
-        data = corona.get_data()
+    def _draw_data(self, draw, data_row, row):
+        data_source, data, last_date = data_row
+        draw.text((70, 165 + 72 * row), "{:20}".format(data_source), fill="rgb(0,0,0)", font=self._font)
         values = ["{:^10}".format("{:d}".format(v)) for v in data]
         draw.text((310, 160 + 72 * row), "".join(values), fill="rgb(0,0,0)", font=self._font_lg)
-        text = "{}".format(datetime.strftime(corona.last_date, "%d-%m-%Y %H:%M"))
+        text = "{}".format(datetime.strftime(last_date, "%d-%m-%Y %H:%M"))
         if data[0] and data[1]:
             death_rate = (data[1] or 0) / data[0]
             text = "{} - Letalidade: {:2.1%}".format(text, death_rate)
@@ -266,13 +475,20 @@ class DataPanel(object):
         draw.text((70, 480), "Região: {}".format(region), fill="rgb(0,0,0)", font=self._font_lg)
 
     def image(self):
+        with _render_seconds.time("panel"):
+            return self._image()
+
+    def _image(self):
+        from PIL import Image, ImageDraw
+
+        self._font, self._font_lg, self._font_sm = _font(18), _font(24), _font(14)
         image = Image.open('res/panel.png')
         draw = ImageDraw.Draw(image)
         self._draw_header(draw)
-        for i, corona in enumerate(self._series):
+        for i, data_row in enumerate(self._rows):
             if i == 0:
-                self._draw_region(draw, corona.region)
-            self._draw_data(draw, corona, i)
+                self._draw_region(draw, self._region)
+            self._draw_data(draw, data_row, i)
 
         bio = io.BytesIO()
         bio.name = 'series.png'
@@ -5,8 +5,8 @@ Postgres Driver External Dependencies:
 """
 
 import os
-import psycopg2 as postgres
-import psycopg2.extras as postres_extras
+
+from dasbot import metrics
 
 
 class PostgreBatchCursor:
@@ -16,6 +16,7 @@ class PostgreBatchCursor:
         self._cursor = cursor
 
     def executemany(self, statement, parameters, **kwargs):
+        import psycopg2.extras as postres_extras
         return postres_extras.execute_batch(self._cursor, statement, parameters, **kwargs)
 
     def __getattr__(self, item):
@@ -29,6 +30,9 @@ class PostgreSQLDriver(object):
         self.config = config
 
     def get_db(self):
+        # o driver só é carregado quando o banco é usado (USE_DB)
+        import psycopg2 as postgres
+
         conn = self.config
         db = postgres.connect(conn["url"])
 
@@ -41,6 +45,8 @@ class PostgreSQLDriver(object):
         return PostgreBatchCursor(db.cursor())
 
 
+_db_seconds = metrics.histogram("dasbot_db_seconds", "Tempo das operações no banco", ("table", "operation"))
+
 _connection = {"url": os.environ.get("POSTGRESQL_URL")}
 
 
@@ -76,31 +82,53 @@ class BaseRepo(object):
     def insert_sql(self):
         return "INSERT INTO {} ({}) VALUES ({});".format(self._table, self.field_list(), self.props_list())
 
-    def select_sql(self, where="1=1"):
-        return "SELECT {} FROM {} WHERE {};".format(self.field_list(), self._table, where)
+    def select_sql(self, where="1=1", order=None):
+        order_by = " ORDER BY {}".format(order) if order else ""
+        return "SELECT {} FROM {} WHERE {}{};".format(self.field_list(), self._table, where, order_by)
 
     def delete_sql(self, where):
         return "DELETE FROM {} WHERE {};".format(self._table, where)
 
     def insert(self, delete_clause=None):
-        db, cur = _get_connection()
-        if delete_clause:
-            cur.execute(delete_clause)
-        if self._rows:
-            cur.executemany(self.insert_sql(), self._rows)
-        db.commit()
-        db.close()
+        with _db_seconds.time(self._table, "insert"):
+            db, cur = _get_connection()
+            if delete_clause:
+                cur.execute(delete_clause)
+            if self._rows:
+                cur.executemany(self.insert_sql(), self._rows)
+            db.commit()
+            db.close()
 
     def load(self, where="1=1"):
         self._rows.clear()
-        db, cur = _get_connection()
-        cur.execute(self.select_sql(where))
-        for row in cur.fetchall():
-            data = dict()
-            for i, field in enumerate(self._fields):
-                data[self._map.get(field)] = row[i]
-            self._rows.append(data)
-        db.close()
+        with _db_seconds.time(self._table, "load"):
+            db, cur = _get_connection()
+            cur.execute(self.select_sql(where))
+            for row in cur.fetchall():
+                data = dict()
+                for i, field in enumerate(self._fields):
+                    data[self._map.get(field)] = row[i]
+                self._rows.append(data)
+            db.close()
+
+    def iterate(self, where="1=1", order=None, batch_size=2000, params=None):
+        """Lê as linhas com um cursor do lado do servidor, buscando batch_size linhas por vez
+        Os valores do where são passados em params, com os marcadores %s do psycopg2
+        """
+        db = PostgreSQLDriver(_connection).get_db()
+        try:
+            # cursor com nome: o psycopg2 usa DECLARE CURSOR e não traz o resultado inteiro
+            cur = db.cursor(name="{}_iterate".format(self._table.split(".")[-1]))
+            cur.itersize = batch_size
+            cur.execute(self.select_sql(where, order), params)
+            for row in cur:
+                data = dict()
+                for i, field in enumerate(self._fields):
+                    data[self._map.get(field)] = row[i]
+                yield data
+            cur.close()
+        finally:
+            db.close()
 
 
 class JobCacheRepo(BaseRepo):
@@ -108,7 +136,7 @@ class JobCacheRepo(BaseRepo):
         super().__init__()
         self._table = "public.jobcache"
         self._fields = ["job_id", "interval", "repeat", "region", "chat_id",
-                        "only_new", "last_cases", "last_deaths", "last_recovery"]
+                        "only_new", "last_version"]
         self._map = {
             "job_id": "job_id",
             "interval": "interval",
@@ -116,13 +144,19 @@ class JobCacheRepo(BaseRepo):
             "region": "region",
             "chat_id": "chat_id",
             "only_new": "new",
-            "last_cases": "cases",
-            "last_deaths": "deaths",
-            "last_recovery": "recovery"
+            "last_version": "version"
         }
 
-    def save(self):
-        self.insert(self.delete_sql("1=1"))
+    def save(self, where="1=1"):
+        self.insert(self.delete_sql(where))
+
+    def migrate(self):
+        """Atualiza tabelas criadas por versões anteriores do setup/bot_db.sql (ver setup/migrate.sql)"""
+        with _db_seconds.time(self._table, "migrate"):
+            db, cur = _get_connection()
+            cur.execute("ALTER TABLE {} ADD COLUMN IF NOT EXISTS last_version bigint DEFAULT 0;".format(self._table))
+            db.commit()
+            db.close()
 
 
 class BotLogRepo(BaseRepo):
@@ -140,6 +174,18 @@ class BotLogRepo(BaseRepo):
     def save(self):
         self.insert()
 
+    def popular(self, commands, limit, days=7):
+        """[(chat_id, comando, texto, pedidos)] mais frequentes dos comandos nos últimos dias"""
+        with _db_seconds.time(self._table, "popular"):
+            db, cur = _get_connection()
+            cur.execute("SELECT chat_id, command, args, COUNT(*) FROM {} WHERE command = ANY(%s) "
+                        "AND create_at > now() - %s * interval '1 day' "
+                        "GROUP BY chat_id, command, args ORDER BY 4 DESC LIMIT %s;".format(self._table),
+                        (commands, days, limit))
+            rows = cur.fetchall()
+            db.close()
+        return rows
+
 
 class CasesRepo(BaseRepo):
     def __init__(self):
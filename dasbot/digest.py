@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo digest
+Resumo do canal: um painel para o Brasil, um para cada UF e um gráfico
+das UFs com mais casos novos desde o último resumo
+
+Os totais são calculados em uma única passagem pelo cache do brasil.io e
+as imagens são renderizadas em lote no pool do módulo render.
+"""
+
+import os
+
+from telegram import InputMediaPhoto
+
+from dasbot import render
+from dasbot.corona import DataPanel, MoversChart, br_ufs
+from dasbot.brasil_io import BrasilIOData
+
+
+# quantidade de UFs no gráfico de maiores altas
+digest_top = int(os.environ.get("DIGEST_TOP", "10"))
+
+# limite do Telegram de fotos por álbum
+MEDIA_GROUP_SIZE = 10
+
+
+def movers(totals, previous=None, top=digest_top):
+    """UFs com mais casos novos em relação aos totais anteriores, ou com mais casos sem eles"""
+    previous = previous or {}
+    changes = []
+    for uf in br_ufs:
+        if uf in totals:
+            change = totals[uf][0] - previous.get(uf, [0])[0]
+            if change > 0:
+                changes.append((uf, change))
+    changes.sort(key=lambda item: item[1], reverse=True)
+    return changes[:top]
+
+
+def build(previous=None, top=digest_top):
+    """Renderiza as imagens do resumo
+    Retorna (imagens, totais), os totais devem ser informados em previous no próximo resumo
+    """
+    totals, last_date = BrasilIOData.rollup()
+    if not totals:
+        return [], {}
+    source = "brasil.io"
+    charts = [DataPanel.from_rows("Brasil", [(source, totals["BR"], last_date)])]
+    for uf, info in br_ufs.items():
+        if uf in totals:
+            charts.append(DataPanel.from_rows(info["name"], [(source, totals[uf], last_date)]))
+    top_changes = movers(totals, previous, top)
+    if top_changes:
+        title = "Casos novos por UF" if previous else "Casos confirmados por UF"
+        charts.append(MoversChart("{} - Fonte: {}".format(title, source), top_changes))
+    return render.images(charts), totals
+
+
+def media_groups(images):
+    """Divide as imagens em grupos de até MEDIA_GROUP_SIZE fotos com tamanhos equilibrados,
+    para que nenhum álbum fique com uma única foto (o Telegram exige ao menos duas)
+    Só há um grupo com uma imagem quando existe apenas uma imagem
+    """
+    count = -(-len(images) // MEDIA_GROUP_SIZE)
+    groups = []
+    start = 0
+    for i in range(count):
+        size = (len(images) - start) // (count - i)
+        groups.append(images[start:start + size])
+        start += size
+    return groups
+
+
+def album(images, caption=None):
+    """Fotos de um álbum, a legenda vai na primeira"""
+    return [InputMediaPhoto(image, caption=caption if i == 0 else None) for i, image in enumerate(images)]
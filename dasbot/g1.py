@@ -6,9 +6,10 @@ import re
 import pytz
 
 from datetime import datetime
-from dateutil import parser
 
-from dasbot.corona import CoronaData, http_get, case_less_eq
+from dasbot import snapshot, singleflight, regions
+from dasbot.sources import manager
+from dasbot.corona import CoronaData, http_get, parse_date
 
 
 _g1_data = {}
@@ -25,20 +26,20 @@ class G1Data(CoronaData):
         self._data_source = "G1"
         self._region = region if region else "BR"
         self._data = None
-        self._match_complete = re.findall(r"([A-zÀ-ú\s]+)[-:\s]*([A-Z]{2})", self._region)
-        self._match_uf = re.findall(r"^[A-Z]{2}$", self._region)
+        self._city_key = None
 
     def _match_region(self, rec):
-        if self._region == "BR":
+        # os registros do G1 não têm o código do IBGE: compara a UF e, só nela, o nome normalizado
+        place = self.place
+        if place is regions.BRAZIL:
             return True
-        elif self._match_uf and "state" in rec:
-            return rec["state"] == self._match_uf[0]
-        elif self._match_complete and "state" in rec and "city_name" in rec:
-            return rec["state"] == self._match_complete[0][1] and \
-                   case_less_eq(rec["city_name"], self._match_complete[0][0].strip())
-        elif "city_name" in rec:
-            return case_less_eq(rec["city_name"],  self._region)
-        return False
+        elif place is None or rec.get("state") != place.uf:
+            return False
+        elif place.kind == regions.STATE:
+            return True
+        if self._city_key is None:
+            self._city_key = regions.normalize(place.name)
+        return regions.normalize(rec.get("city_name") or "") == self._city_key
 
     def get_data(self):
         return [self._data.get(k, 0) or 0 for k in G1Data.categories()]
@@ -74,20 +75,37 @@ class G1Data(CoronaData):
             if self._data else None
 
     def _load_data(self):
-        if not _g1_data:
-            G1Data().load()
+        self._count_cache(bool(_g1_data))
+        if not _g1_data and not manager.is_managed("g1"):
+            self._fetch(G1Data.load)
         data = copy.deepcopy(_g1_data)
         if data:
             date = re.findall(r"(\d{1,2})/(\d{1,2})/(\d{4}), às (\d{1,2}:\d{1,2})", data["updated_at"])[0]
-            self._version = parser.parse("{}-{}-{}T{}:00-0300".format(date[2], date[1], date[0], date[3])).timestamp()
+            self._version = parse_date("{}-{}-{}T{}:00-0300".format(date[2], date[1], date[0], date[3])).timestamp()
             self._raw_data = data
             return True
         return False
 
     @staticmethod
+    @singleflight.shared("g1.load")
     def load():
         global _g1_data
         url = "https://api.especiaisg1.globo/api/eventos/brasil/"
         response = http_get(url)
         if response:
-            _g1_data = json.loads(response.read())
+            data = json.loads(response.read())
+            if data:
+                _g1_data = data
+                snapshot.save("g1", data)
+                return True
+        return False
+
+    @staticmethod
+    def restore():
+        """Carrega os dados do snapshot se ele for mais novo que o cache, retorna True se carregou"""
+        global _g1_data
+        data = snapshot.load_if_newer("g1")
+        if data:
+            _g1_data = data
+            return True
+        return False
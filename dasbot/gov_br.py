@@ -4,9 +4,9 @@ import copy
 import json
 import pytz
 
-from dateutil import parser
-
-from dasbot.corona import CoronaData, http_get, br_ufs
+from dasbot import snapshot, singleflight, regions
+from dasbot.sources import manager
+from dasbot.corona import CoronaData, http_get, parse_date
 
 
 _gov_br_data = {}
@@ -27,17 +27,19 @@ class GovBR(CoronaData):
     def _update_stats(self):
         self._gov = {}
         if self._raw_data:
-            date = parser.parse(self._raw_data["br"].get("dt_updated"))
+            date = parse_date(self._raw_data["br"].get("dt_updated"))
             self._last_date = date.astimezone(pytz.timezone("America/Sao_Paulo"))
-            region = self._region
-            if region == "BR":
+            place = self.place
+            if place is regions.BRAZIL:
                 item = self._raw_data["br"]
                 self._gov["cases"] = int(item.get("confirmados").get("total", "0"))
                 self._gov["recovered"] = int(item.get("confirmados").get("recuperados", "0"))
                 self._gov["deaths"] = int(item.get("obitos").get("total", "0"))
             else:
                 categories = {"cases": "casosAcumulado", "deaths": "obitosAcumulado"}
-                item = [k for k in self._raw_data["states"] if k.get("nome") == region]
+                # o ministério só tem os dados por estado, identificados pela sigla
+                uf = place.uf if place and place.kind == regions.STATE else None
+                item = [k for k in self._raw_data["states"] if uf and k.get("nome") == uf]
                 if item and len(item) == 1:
                     for k in categories:
                         self._gov[k] = item[0].get(categories[k], 0)
@@ -45,8 +47,9 @@ class GovBR(CoronaData):
                     self._last_date = None
 
     def _load_data(self):
-        if not _gov_br_data:
-            GovBR.load()
+        self._count_cache(bool(_gov_br_data))
+        if not _gov_br_data and not manager.is_managed("gov_br"):
+            self._fetch(GovBR.load)
         self._raw_data = copy.deepcopy(_gov_br_data)
         if self._raw_data:
             return True
@@ -62,10 +65,25 @@ class GovBR(CoronaData):
             return json.loads(response.read())
 
     @staticmethod
+    @singleflight.shared("gov_br.load")
     def load():
+        """Carrega os dados do país e dos estados e só substitui o cache se ambos foram lidos"""
+        global _gov_br_data
+        data = {"br": GovBR.load_json("PortalGeralApi"),
+                "states": GovBR.load_json("PortalEstado")}
+        if data["br"] and data["states"]:
+            _gov_br_data = data
+            snapshot.save("gov_br", data)
+            return True
+        return False
+
+    @staticmethod
+    def restore():
+        """Carrega os dados do snapshot se ele for mais novo que o cache, retorna True se carregou"""
         global _gov_br_data
-        data = GovBR.load_json("PortalGeralApi")
-        _gov_br_data["br"] = data
-        data = GovBR.load_json("PortalEstado")
-        _gov_br_data["states"] = data
+        data = snapshot.load_if_newer("gov_br")
+        if data:
+            _gov_br_data = data
+            return True
+        return False
 
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo history
+Série histórica local (sqlite) com os valores diários de cada região
+
+Guarda uma linha por fonte, região (código do IBGE) e data, assim a série
+pode ser exportada ou consultada sem buscar todas as páginas na origem de
+novo. A série dos estados do brasil.io é gravada a cada cálculo das
+tendências, as dos municípios quando são buscadas pelo /chart ou pelo
+backfill.py. Desativada com HISTORY_DB vazio, como nos benchmarks, que
+não podem gravar as séries das fixtures na série local do bot.
+"""
+
+import os
+import sqlite3
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+history_db = os.environ.get("HISTORY_DB", "logs/history.sqlite")
+
+COLUMNS = ["source", "region", "date", "confirmed", "deaths"]
+
+_schema = """
+CREATE TABLE IF NOT EXISTS series (
+    source TEXT NOT NULL,
+    region TEXT NOT NULL,
+    date TEXT NOT NULL,
+    confirmed INTEGER,
+    deaths INTEGER,
+    PRIMARY KEY (source, region, date)
+) WITHOUT ROWID;
+"""
+
+
+def enabled():
+    return bool(history_db)
+
+
+def _connect(path=None):
+    path = path or history_db
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(_schema)
+    return db
+
+
+def brasil_io_rows(records):
+    """Linhas (região, data, confirmados, mortes) dos registros do brasil.io"""
+    rows = []
+    for rec in records:
+        code = rec.get("city_ibge_code")
+        if code and rec.get("date"):
+            rows.append((str(code), rec["date"], rec.get("confirmed") or 0, rec.get("deaths") or 0))
+    return rows
+
+
+def add(source, rows, path=None):
+    """Grava as linhas (região, data, confirmados, mortes) da fonte, substituindo as existentes"""
+    if not rows:
+        return 0
+    db = _connect(path)
+    try:
+        with db:
+            db.executemany("INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?)",
+                           ((source,) + tuple(row) for row in rows))
+    finally:
+        db.close()
+    return len(rows)
+
+
+def record(source, records):
+    """Grava os registros do brasil.io se a série local estiver ativa, sem interromper quem chamou"""
+    if not enabled():
+        return 0
+    try:
+        return add(source, brasil_io_rows(records))
+    except sqlite3.Error:
+        logger.exception("History write failed: %s", source)
+        return 0
+
+
+def latest_dates(source, path=None):
+    """{região: última data gravada} da fonte"""
+    db = _connect(path)
+    try:
+        cur = db.execute("SELECT region, MAX(date) FROM series WHERE source = ? GROUP BY region", (source,))
+        return dict(cur.fetchall())
+    finally:
+        db.close()
+
+
+def region_series(source, region, until=None, path=None):
+    """Registros da região em ordem de data, ou None se não houver linhas até a data until"""
+    if not enabled():
+        return None
+    try:
+        db = _connect(path)
+        try:
+            rows = db.execute("SELECT date, confirmed, deaths FROM series WHERE source = ? AND region = ? "
+                              "ORDER BY date", (source, str(region))).fetchall()
+        finally:
+            db.close()
+    except sqlite3.Error:
+        logger.exception("History read failed: %s %s", source, region)
+        return None
+    if not rows or (until and rows[-1][0] < until):
+        return None
+    return [{"city_ibge_code": region, "date": date, "confirmed": confirmed, "deaths": deaths}
+            for date, confirmed, deaths in rows]
+
+
+def iterate(source=None, since=None, batch_size=5000, path=None):
+    """Lê as linhas ordenadas por fonte, data e região em lotes, sem carregar a série em memória"""
+    where = []
+    params = []
+    if source:
+        where.append("source = ?")
+        params.append(source)
+    if since:
+        where.append("date >= ?")
+        params.append(since)
+    sql = "SELECT {} FROM series{} ORDER BY source, date, region".format(
+        ", ".join(COLUMNS), " WHERE " + " AND ".join(where) if where else "")
+    db = _connect(path)
+    try:
+        cur = db.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(COLUMNS, row))
+    finally:
+        db.close()
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo jobs
+Lista persistente dos jobs do /listen
+
+Sem banco, os jobs ficam em um arquivo base (pickle) e em um journal
+append-only com as inclusões e remoções feitas depois dele, então o
+/listen e o /mute gravam apenas um registro. Cada registro tem tamanho e
+crc32: uma gravação interrompida perde só o último registro. O journal é
+compactado no arquivo base a cada JOBS_COMPACT registros e no save().
+"""
+
+import os
+import glob
+import zlib
+import pickle
+import struct
+import logging
+import threading
+
+from dasbot.db import JobCacheRepo
+
+
+logger = logging.getLogger(__name__)
+
+# quantidade de registros no journal que dispara a compactação
+compact_every = int(os.environ.get("JOBS_COMPACT", "1000"))
+
+# tamanho e crc32 de cada registro do journal
+_record = struct.Struct("<II")
+
+
+def shard(key, count):
+    """Partição de um chat_id entre count processos, estável entre execuções"""
+    return zlib.crc32(str(key).encode("utf-8")) % count
+
+
+def _journal_name(file_name):
+    return "{}.journal".format(file_name)
+
+
+def _remove(file_name):
+    try:
+        os.remove(file_name)
+    except FileNotFoundError:
+        pass
+
+
+def _write_base(file_name, jobs):
+    """Grava o arquivo base em um arquivo temporário e substitui o anterior"""
+    temp_name = "{}.tmp".format(file_name)
+    with open(temp_name, 'wb') as f:
+        pickle.dump(jobs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_name, file_name)
+
+
+def _read(file_name):
+    """Lê o arquivo base e aplica o journal
+    Retorna (jobs, registros lidos do journal, True se o journal estava íntegro)
+    """
+    jobs = {}
+    if os.path.exists(file_name):
+        with open(file_name, 'rb') as f:
+            jobs = pickle.load(f)
+    entries = 0
+    journal = _journal_name(file_name)
+    if not os.path.exists(journal):
+        return jobs, entries, True
+    with open(journal, 'rb') as f:
+        data = f.read()
+    pos = 0
+    while pos < len(data):
+        start = pos + _record.size
+        if start > len(data):
+            break
+        size, crc = _record.unpack_from(data, pos)
+        payload = data[start:start + size]
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            break
+        op, key, value = pickle.loads(payload)
+        if op == "set":
+            jobs[key] = value
+        else:
+            jobs.pop(key, None)
+        pos = start + size
+        entries += 1
+    if pos < len(data):
+        logger.warning('Journal "%s" truncated after %d records', journal, entries)
+        return jobs, entries, False
+    return jobs, entries, True
+
+
+class JobGroup(object):
+    """Jobs de vários chats com a mesma região e intervalo, executados por um único timer"""
+
+    def __init__(self, region, interval):
+        self.region = region
+        self.interval = interval
+        self.job = None
+        self._members = []
+        self._lock = threading.Lock()
+
+    def add(self, context):
+        member = GroupMember(self, context)
+        with self._lock:
+            self._members.append(member)
+        return member
+
+    def remove(self, member):
+        with self._lock:
+            if member in self._members:
+                self._members.remove(member)
+            empty = not self._members
+        if empty and self.job:
+            self.job.schedule_removal()
+
+    @property
+    def members(self):
+        with self._lock:
+            return list(self._members)
+
+
+class GroupMember(object):
+    """Job de um chat dentro de um JobGroup, com os atributos do Job usados pelo JobsInfo"""
+
+    def __init__(self, group, context):
+        self.group = group
+        self.context = context
+        self.repeat = True
+
+    @property
+    def interval(self):
+        return self.group.interval
+
+    def schedule_removal(self):
+        self.group.remove(self)
+
+
+class JobsInfo(object):
+    def __init__(self, file_name, partition=None):
+        self._jobs = dict()
+        self.file_name = file_name
+        self.partition = partition
+        self._props = ["interval", "repeat", "context"]
+        self._entries = 0
+        self._lock = threading.Lock()
+
+    def owns(self, key):
+        """Indica se o job pertence à partição (índice, total) deste processo"""
+        return not self.partition or shard(key, self.partition[1]) == self.partition[0]
+
+    @staticmethod
+    def part_name(file_name, index, count):
+        return file_name if count == 1 else "{}.{}-{}".format(file_name, index, count)
+
+    @staticmethod
+    def split(file_name, count):
+        """Redistribui os jobs gravados em um arquivo por processo, de acordo com a partição do chat_id"""
+        names = set()
+        for name in [file_name] + glob.glob("{}.*".format(file_name)):
+            if name.endswith(".tmp") or not os.path.exists(name):
+                continue
+            names.add(name[:-len(".journal")] if name.endswith(".journal") else name)
+        parts = [JobsInfo.part_name(file_name, i, count) for i in range(count)]
+        if names <= set(parts):
+            return
+        jobs = {}
+        for name in names:
+            jobs.update(_read(name)[0])
+        for i, name in enumerate(parts):
+            _write_base(name, {k: v for k, v in jobs.items() if shard(k, count) == i})
+            _remove(_journal_name(name))
+        for name in names - set(parts):
+            _remove(name)
+            _remove(_journal_name(name))
+
+    @property
+    def jobs(self):
+        return self._jobs
+
+    def _data(self, job):
+        return {var: getattr(job, var) for var in self._props}
+
+    def _append(self, op, key, value=None):
+        payload = pickle.dumps((op, key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            with open(_journal_name(self.file_name), 'ab') as f:
+                f.write(_record.pack(len(payload), zlib.crc32(payload)) + payload)
+                f.flush()
+                os.fsync(f.fileno())
+            self._entries += 1
+            compact = self._entries >= compact_every
+        if compact:
+            self.save()
+
+    def save(self):
+        """Compacta: grava todos os jobs no arquivo base e descarta o journal"""
+        with self._lock:
+            _write_base(self.file_name, {key: self._data(job) for key, job in list(self._jobs.items())})
+            _remove(_journal_name(self.file_name))
+            self._entries = 0
+
+    def load(self):
+        jobs, self._entries, complete = _read(self.file_name)
+        if not complete:
+            # descarta o registro incompleto para que os próximos sejam gravados após um registro válido
+            _write_base(self.file_name, jobs)
+            _remove(_journal_name(self.file_name))
+            self._entries = 0
+        return {k: v for k, v in jobs.items() if self.owns(k)}
+
+    def restore(self, key, data):
+        """Registra um job lido no load, sem gravar"""
+        self._jobs[key] = data
+
+    def push(self, key, data):
+        self._jobs[key] = data
+        self._append("set", key, self._data(data))
+
+    def pop(self, key):
+        result = self._jobs.pop(key)
+        self._append("del", key)
+        return result
+
+    def exists(self, key):
+        return key in self._jobs
+
+
+class JobsDBInfo(JobsInfo):
+    def __init__(self, partition=None):
+        super().__init__("", partition)
+        self._owned = set()
+
+    @staticmethod
+    def _where(key):
+        return "job_id = '{}'".format(int(key))
+
+    def _row(self, key, job):
+        data = dict()
+        data["job_id"] = key
+        for prop in ["interval", "repeat"]:
+            data[prop] = getattr(job, prop)
+        for prop in ["region", "chat_id", "new"]:
+            data[prop] = job.context.get(prop)
+        data["version"] = job.context.get("version") or 0
+        return data
+
+    def push(self, key, data):
+        """Grava apenas a linha do job"""
+        self._jobs[key] = data
+        self._owned.add(key)
+        repo = JobCacheRepo()
+        repo.add(self._row(key, data))
+        repo.save(self._where(key))
+
+    def pop(self, key):
+        """Apaga apenas a linha do job"""
+        result = self._jobs.pop(key)
+        JobCacheRepo().save(self._where(key))
+        return result
+
+    def save(self):
+        where = "1=1"
+        if self.partition:
+            # a tabela é compartilhada entre os processos, apaga apenas os jobs desta partição
+            owned = self._owned | set(self.jobs.keys())
+            where = "job_id IN ({})".format(", ".join("'{}'".format(int(k)) for k in owned)) if owned else "1=0"
+        repo = JobCacheRepo()
+        for key, job in list(self.jobs.items()):
+            repo.add(self._row(key, job))
+        repo.save(where)
+
+    def load(self):
+        jobs = dict()
+        repo = JobCacheRepo()
+        repo.migrate()
+        repo.load()
+        for row in repo.rows:
+            if not self.owns(row["job_id"]):
+                continue
+            self._owned.add(row["job_id"])
+            data = dict()
+            data["interval"] = row["interval"]
+            data["repeat"] = row["repeat"]
+            data["context"] = {"region": row["region"],
+                               "chat_id": row["chat_id"],
+                               "new": row["new"],
+                               "version": row["version"]}
+            jobs[row["job_id"]] = data
+        return jobs
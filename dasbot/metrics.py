@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo metrics
+Contadores e histogramas de tempo no formato de texto do Prometheus
+
+Os contadores são sempre atualizados. As medições de tempo dos histogramas
+são amostradas com a taxa METRICS_SAMPLE_RATE (0 a 1) para manter o custo
+baixo nos caminhos mais usados. As métricas ficam disponíveis em
+http://127.0.0.1:<METRICS_PORT>/metrics quando o servidor é iniciado.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+sample_rate = float(os.environ.get("METRICS_SAMPLE_RATE", "1"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = {}
+_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{{{}}}".format(",".join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs))
+
+
+class Counter(object):
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, value=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} counter".format(self.name)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, total in items:
+            lines.append("{}{} {}".format(self.name, _format_labels(self.labels, values), total))
+        return lines
+
+
+class _Timer(object):
+
+    def __init__(self, histogram, label_values):
+        self._histogram = histogram
+        self._label_values = label_values
+        self._start = None
+
+    def __enter__(self):
+        if random.random() < sample_rate:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self._start is not None:
+            self._histogram.observe(time.perf_counter() - self._start, *self._label_values)
+
+
+class Histogram(object):
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            if label_values not in self._values:
+                # contagem por bucket, soma e total de observações
+                self._values[label_values] = [[0] * len(self.buckets), 0, 0]
+            data = self._values[label_values]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[0][i] += 1
+            data[1] += value
+            data[2] += 1
+
+    def time(self, *label_values):
+        """Mede o tempo do bloco with, de acordo com a taxa de amostragem"""
+        return _Timer(self, label_values)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        for values, (counts, total, count) in items:
+            for bound, bucket in zip(self.buckets, counts):
+                lines.append("{}_bucket{} {}".format(self.name,
+                                                     _format_labels(self.labels, values, ("le", bound)), bucket))
+            lines.append("{}_bucket{} {}".format(self.name, _format_labels(self.labels, values, ("le", "+Inf")), count))
+            lines.append("{}_sum{} {}".format(self.name, _format_labels(self.labels, values), total))
+            lines.append("{}_count{} {}".format(self.name, _format_labels(self.labels, values), count))
+        return lines
+
+
+def counter(name, documentation, labels=()):
+    """Retorna o contador registrado com o nome, criando na primeira chamada"""
+    with _lock:
+        if name not in _registry:
+            _registry[name] = Counter(name, documentation, labels)
+        return _registry[name]
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    """Retorna o histograma registrado com o nome, criando na primeira chamada"""
+    with _lock:
+        if name not in _registry:
+            _registry[name] = Histogram(name, documentation, labels, buckets)
+        return _registry[name]
+
+
+def render():
+    """Todas as métricas no formato de texto do Prometheus"""
+    lines = []
+    with _lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(port, address="127.0.0.1"):
+    """Inicia o endpoint /metrics em uma thread e retorna o servidor"""
+    server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    logger.info("Metrics endpoint on http://%s:%d/metrics", address, server.server_address[1])
+    return server
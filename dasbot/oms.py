@@ -7,6 +7,8 @@ import pytz
 from datetime import datetime
 from gzip import decompress
 
+from dasbot import snapshot, singleflight, regions
+from dasbot.sources import manager
 from dasbot.corona import CoronaData, http_get
 
 
@@ -26,10 +28,10 @@ class OMSData(CoronaData):
 
     def get_series(self):
         cases = {}
-        if self._raw_data and self._region == "BR":
+        if self._raw_data and self.place is regions.BRAZIL:
             for data in self._raw_data:
                 date = datetime.fromtimestamp(data[0] / 1000).astimezone(pytz.timezone("America/Sao_Paulo")).date()
-                if date <= datetime.today():
+                if date <= datetime.today().date():
                     cases[date] = {"c": data[6], "d": data[4]}
 
         dates = [k for k in cases.keys()]
@@ -42,7 +44,7 @@ class OMSData(CoronaData):
 
     def _update_stats(self):
         self._oms = {}
-        if self._raw_data and self._region == "BR":
+        if self._raw_data and self.place is regions.BRAZIL:
             categories = {"cases": 6, "deaths": 4}
             for k, v in categories.items():
                 self._oms[k] = self._raw_data[-1][v]
@@ -52,14 +54,16 @@ class OMSData(CoronaData):
             self._last_date = None
 
     def _load_data(self):
-        if not _oms_data:
-            OMSData.load()
+        self._count_cache(bool(_oms_data))
+        if not _oms_data and not manager.is_managed("oms"):
+            self._fetch(OMSData.load)
         self._raw_data = copy.deepcopy(_oms_data)
         if self._raw_data:
             return True
         return False
 
     @staticmethod
+    @singleflight.shared("oms.load")
     def load():
         global _oms_data
         response = http_get("https://dashboards-dev.sprinklr.com/data/9043/global-covid19-who-gis.json",
@@ -67,4 +71,19 @@ class OMSData(CoronaData):
         if response:
             response_data = decompress(response.read())
             data = json.loads(response_data.decode("utf-8"))
-            _oms_data = [d for d in data["rows"] if d[1] == "BR"]
+            rows = [d for d in data["rows"] if d[1] == "BR"]
+            if rows:
+                _oms_data = rows
+                snapshot.save("oms", rows)
+                return True
+        return False
+
+    @staticmethod
+    def restore():
+        """Carrega os dados do snapshot se ele for mais novo que o cache, retorna True se carregou"""
+        global _oms_data
+        data = snapshot.load_if_newer("oms")
+        if data:
+            _oms_data = data
+            return True
+        return False
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo prewarm
+Guarda as respostas dos comandos por versão dos dados e prepara as mais
+pedidas logo depois que uma nova versão das fontes chega
+
+As chaves das respostas já têm as versões das fontes, então uma resposta
+guardada vale até a próxima atualização. Depois de cada atualização os
+pedidos mais frequentes (public.botlog com USE_DB ou os contadores em
+memória) são calculados em segundo plano, e o primeiro /chart de uma
+região popular não espera pela renderização. No cluster cada worker
+prepara apenas os pedidos dos chats da sua partição.
+"""
+
+import os
+import time
+import logging
+import threading
+
+from collections import Counter, OrderedDict
+
+from dasbot import metrics, singleflight
+from dasbot.jobs import shard
+
+
+logger = logging.getLogger(__name__)
+
+use_db = os.environ.get("USE_DB", False)
+
+# quantidade de pedidos preparados a cada atualização, 0 desativa
+prewarm_top = int(os.environ.get("PREWARM_TOP", "20"))
+# espera após uma atualização, para juntar as fontes que atualizam quase juntas
+prewarm_delay = float(os.environ.get("PREWARM_DELAY", "5"))
+# respostas guardadas
+prewarm_cache = int(os.environ.get("PREWARM_CACHE", "128"))
+# dias do botlog considerados na popularidade
+prewarm_days = int(os.environ.get("PREWARM_DAYS", "7"))
+
+_MAX_COUNTS = 10000
+
+_cache_total = metrics.counter("dasbot_prewarm_cache_total", "Leituras das respostas guardadas", ("name", "result"))
+_warm_seconds = metrics.histogram("dasbot_prewarm_seconds", "Tempo de cada preparação")
+
+_results = OrderedDict()
+_results_lock = threading.Lock()
+_counts = Counter()
+_counts_lock = threading.Lock()
+_warmers = {}
+_timer = None
+_timer_lock = threading.Lock()
+_run_lock = threading.Lock()
+# (índice, total) do worker, os pedidos do botlog de outras partições são ignorados
+partition = None
+
+
+def get(key, func, *args):
+    """Resposta guardada da chave ou func(*args) compartilhada pelo singleflight
+    A chave deve ter as versões dos dados. Resultados vazios não são guardados
+    """
+    name = key[0] if isinstance(key, tuple) else key
+    with _results_lock:
+        if key in _results:
+            _results.move_to_end(key)
+            _cache_total.inc(name, "hit")
+            return _results[key]
+    _cache_total.inc(name, "miss")
+    result = singleflight.do(key, func, *args)
+    if result:
+        with _results_lock:
+            _results[key] = result
+            while len(_results) > prewarm_cache:
+                _results.popitem(last=False)
+    return result
+
+
+def touch(command, text):
+    """Conta um pedido para a popularidade em memória"""
+    with _counts_lock:
+        _counts[(command, text)] += 1
+        if len(_counts) > _MAX_COUNTS:
+            kept = _counts.most_common(_MAX_COUNTS // 2)
+            _counts.clear()
+            _counts.update(dict(kept))
+
+
+def popular(top=prewarm_top):
+    """[(comando, texto)] mais pedidos, do botlog com USE_DB ou dos contadores em memória"""
+    if use_db:
+        from dasbot.db import BotLogRepo
+        try:
+            rows = BotLogRepo().popular(list(_warmers), top * 100, prewarm_days)
+            counts = Counter()
+            for chat_id, command, text, count in rows:
+                if partition is None or shard(chat_id, partition[1]) == partition[0]:
+                    counts[(command, text)] += count
+            return [key for key, _ in counts.most_common(top)]
+        except Exception:
+            logger.exception("Botlog popularity query failed")
+    with _counts_lock:
+        return [key for key, _ in _counts.most_common() if key[0] in _warmers][:top]
+
+
+def register(command, warmer):
+    """warmer(texto) prepara a resposta do comando como o botlog registra (/chart, /stats, text)"""
+    _warmers[command] = warmer
+
+
+def warm(top=prewarm_top):
+    """Prepara as respostas dos pedidos mais frequentes, retorna quantos foram preparados"""
+    done = 0
+    with _run_lock, _warm_seconds.time():
+        start = time.monotonic()
+        for command, text in popular(top):
+            try:
+                _warmers[command](text)
+                done += 1
+            except Exception:
+                logger.exception('Prewarm failed "%s %s"', command, text)
+        logger.info("Prewarmed %d requests in %.1fs", done, time.monotonic() - start)
+    return done
+
+
+def _run():
+    global _timer
+    with _timer_lock:
+        _timer = None
+    warm()
+
+
+def update(name):
+    """Listener do gerenciador de fontes: agenda a preparação após cada nova versão"""
+    global _timer
+    if not prewarm_top or not _warmers:
+        return
+    with _timer_lock:
+        if _timer is None:
+            _timer = threading.Timer(prewarm_delay, _run)
+            _timer.daemon = True
+            _timer.start()
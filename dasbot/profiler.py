@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo profiler
+Profiler por amostragem de todas as threads do processo
+
+Em intervalos fixos a pilha de cada thread (handlers, jobs, fontes) é lida
+com sys._current_frames(). O resultado pode ser exportado no formato de
+pilhas colapsadas (flamegraph.pl, speedscope) ou como as funções mais vistas.
+"""
+
+import os
+import sys
+import time
+import threading
+
+from collections import Counter
+
+
+# duração máxima de uma sessão de profiling, em segundos
+max_seconds = int(os.environ.get("PROFILE_MAX_SECONDS", "120"))
+
+_running = threading.Lock()
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.elapsed = 0
+        self._stacks = Counter()
+
+    def run(self, seconds):
+        """Amostra as pilhas de todas as threads durante o tempo informado (limitado a PROFILE_MAX_SECONDS)"""
+        me = threading.get_ident()
+        end = time.monotonic() + min(seconds, max_seconds)
+        start = time.monotonic()
+        while time.monotonic() < end:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        self.elapsed = time.monotonic() - start
+        return self
+
+    def collapsed(self):
+        """Pilhas no formato "thread;func1;func2 contagem", uma por linha"""
+        return "\n".join("{} {}".format(stack, count) for stack, count in self._stacks.most_common())
+
+    def top(self, limit=20):
+        """Funções mais amostradas, pelo tempo próprio e pelo tempo total"""
+        total = sum(self._stacks.values()) or 1
+        own = Counter()
+        cumulative = Counter()
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for name in set(frames):
+                cumulative[name] += count
+        lines = ["{} amostras em {:.1f}s".format(self.samples, self.elapsed), "",
+                 "{:>7} {:>7}  função".format("próprio", "total")]
+        for name, count in own.most_common(limit):
+            lines.append("{:6.1%} {:6.1%}  {}".format(count / total, cumulative[name] / total, name))
+        return "\n".join(lines)
+
+
+def profile(seconds, interval=0.005):
+    """Executa uma sessão de profiling, retorna None se já houver uma em andamento"""
+    if not _running.acquire(blocking=False):
+        return None
+    try:
+        return SamplingProfiler(interval).run(seconds)
+    finally:
+        _running.release()
+
+
+def profile_to_files(seconds, path="logs"):
+    """Executa uma sessão de profiling e grava o resultado em arquivos, retorna os nomes"""
+    profiler = profile(seconds)
+    if not profiler:
+        return None
+    name = os.path.join(path, "profile_{}".format(time.strftime("%Y_%m_%d_%H%M%S")))
+    with open("{}.txt".format(name), "w") as f:
+        f.write(profiler.top(50))
+    with open("{}.collapsed".format(name), "w") as f:
+        f.write(profiler.collapsed())
+    return ["{}.txt".format(name), "{}.collapsed".format(name)]
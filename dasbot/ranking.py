@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo ranking
+Municípios com as maiores altas de casos confirmados, para o comando /top
+
+A cada nova versão dos dados do brasil.io os valores de cada município são
+comparados com os do dia anterior e os maiores aumentos absolutos e
+relativos, do Brasil e de cada UF, são separados com heapq.nlargest. O
+comando apenas lê as listas já ordenadas. Só o processo que atualiza as
+fontes calcula e grava o snapshot "ranking"; os workers do cluster apenas
+leem o ranking publicado.
+"""
+
+import os
+import heapq
+import logging
+import threading
+
+from collections import namedtuple
+
+from dasbot import snapshot, singleflight
+from dasbot.sources import manager
+from dasbot.corona import br_ufs
+from dasbot import brasil_io
+
+
+logger = logging.getLogger(__name__)
+
+# tamanho de cada ranking guardado
+top_size = int(os.environ.get("TOP_SIZE", "50"))
+# casos mínimos no dia anterior para entrar no ranking relativo
+top_min_cases = int(os.environ.get("TOP_MIN_CASES", "100"))
+
+ABSOLUTE = "abs"
+RELATIVE = "rel"
+
+Mover = namedtuple("Mover", ["code", "name", "uf", "cases", "increase", "ratio"])
+
+_state = None
+_ranking = None
+_lock = threading.Lock()
+
+
+class Ranking(object):
+    """Listas ordenadas dos maiores aumentos por escopo (None para o Brasil ou a UF) e tipo"""
+
+    def __init__(self, movers, version, date, base_date):
+        self.version = version
+        self.date = date
+        self.base_date = base_date
+        self._lists = {}
+        scopes = {None: movers}
+        for mover in movers:
+            scopes.setdefault(mover.uf, []).append(mover)
+        for scope, items in scopes.items():
+            self._lists[(scope, ABSOLUTE)] = heapq.nlargest(top_size, items, key=lambda m: m.increase)
+            relative = [m for m in items if m.cases - m.increase >= top_min_cases]
+            self._lists[(scope, RELATIVE)] = heapq.nlargest(top_size, relative, key=lambda m: m.ratio)
+
+    def top(self, count, kind=ABSOLUTE, uf=None):
+        return [m for m in self._lists.get((uf, kind), [])[:count] if m.increase > 0]
+
+
+def _city_values(records):
+    """{código: (nome, uf, confirmados)} dos municípios e a data dos dados"""
+    values = {}
+    date = None
+    for rec in records:
+        code = rec.get("city_ibge_code")
+        if rec.get("city") and code and rec.get("state") in br_ufs:
+            values[code] = (rec["city"], rec["state"], rec.get("confirmed") or 0)
+            date = max(date, rec.get("date")) if date else rec.get("date")
+    return values, date
+
+
+def _advance(state, values, date):
+    """Atualiza o estado: com uma data nova os valores atuais viram a base de comparação"""
+    if state and state["date"] and date and date > state["date"]:
+        return {"date": date, "values": values, "base_date": state["date"], "base": state["values"]}
+    if state:
+        return {"date": date, "values": values, "base_date": state["base_date"], "base": state["base"]}
+    return {"date": date, "values": values, "base_date": None, "base": {}}
+
+
+def _movers(state):
+    movers = []
+    base = state["base"]
+    for code, (name, uf, cases) in state["values"].items():
+        if code not in base:
+            continue
+        before = base[code][2]
+        increase = cases - before
+        movers.append(Mover(code, name, uf, cases, increase, increase / before if before > 0 else 0.0))
+    return movers
+
+
+def update(name):
+    """Listener do gerenciador de fontes: recalcula o ranking a cada nova versão do brasil.io"""
+    global _state, _ranking
+    if name != "brasil_io":
+        return
+    version = snapshot.version("brasil_io")
+    values, date = _city_values(brasil_io._raw_data)
+    if not values:
+        return
+    with _lock:
+        if _state is None:
+            # valores do dia anterior gravados antes do restart
+            _state = snapshot.load("ranking")
+        _state = _advance(_state, values, date)
+        state = _state
+    _ranking = Ranking(_movers(state), version, state["date"], state["base_date"])
+    snapshot.save("ranking", dict(state, version=version))
+    logger.info("Ranking computed for version %d, %d cities", version, len(state["values"]))
+
+
+def restore():
+    """Lê o ranking publicado se for mais novo que o carregado, retorna True se carregou"""
+    global _state, _ranking
+    state = snapshot.load_if_newer("ranking")
+    if not state or "version" not in state:
+        return False
+    with _lock:
+        _state = state
+    _ranking = Ranking(_movers(state), state["version"], state["date"], state["base_date"])
+    return True
+
+
+def ranking():
+    """Ranking da última versão. Sem o gerenciador de fontes, calcula na primeira consulta de cada versão"""
+    version = snapshot.version("brasil_io")
+    if (_ranking is None or _ranking.version != version) and not manager.is_managed("brasil_io"):
+        if not brasil_io._raw_data:
+            # como no _load_data das fontes, o cache só é carregado quando está vazio
+            brasil_io.BrasilIOData()._fetch(brasil_io.BrasilIOData.load)
+            version = snapshot.version("brasil_io")
+        singleflight.do(("ranking.update", version), update, "brasil_io")
+    return _ranking
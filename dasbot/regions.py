@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo regions
+Resolve o texto enviado pelo usuário para uma região com o código do IBGE
+
+O índice tem o Brasil, as UFs do br_ufs e os municípios dos dados do
+brasil.io, e é reconstruído a cada nova versão desses dados. A busca ignora
+acentos e maiúsculas e, se não houver um nome exato, usa um índice de
+trigramas para tolerar erros de digitação ("Sao Paolo", "belo horisonte").
+As fontes comparam os registros pelo código, sem comparar nomes a cada registro.
+"""
+
+import os
+import re
+import threading
+import unicodedata
+
+from collections import namedtuple, Counter
+
+from dasbot.corona import br_ufs
+
+
+# similaridade mínima (coeficiente de Dice dos trigramas) para aceitar um nome aproximado
+min_score = float(os.environ.get("REGION_MIN_SCORE", "0.5"))
+
+COUNTRY = "country"
+STATE = "state"
+CITY = "city"
+
+Region = namedtuple("Region", ["code", "name", "uf", "kind"])
+
+BRAZIL = Region("BR", "Brasil", None, COUNTRY)
+
+# "Cidade - UF", "Cidade/UF", "Cidade, UF" ou "Cidade UF"
+_qualified_re = re.compile(r"^(.+?)[\s,:/-]+([A-Za-z]{2})$")
+_separator_re = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text):
+    """Texto sem acentos, em minúsculas e com um espaço entre as palavras"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _separator_re.sub(" ", text).strip()
+
+
+def _trigrams(key):
+    padded = "  {} ".format(key)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class RegionIndex(object):
+    """Índice imutável dos nomes normalizados e dos trigramas das regiões"""
+
+    def __init__(self, regions, weights=None):
+        self._regions = list(regions)
+        self._weights = weights or {}
+        self._by_code = {region.code: region for region in self._regions}
+        self._names = {}
+        self._grams = {}
+        self._sizes = []
+        for i, region in enumerate(self._regions):
+            key = normalize(region.name)
+            self._names.setdefault(key, []).append(i)
+            grams = _trigrams(key)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._grams.setdefault(gram, []).append(i)
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._regions)
+
+    def get(self, code):
+        return self._by_code.get(code)
+
+    def _rank(self, i):
+        # em nomes iguais, prefere o município ao estado e o município com mais casos
+        region = self._regions[i]
+        return region.kind == CITY, self._weights.get(region.code, 0)
+
+    def lookup(self, name, uf=None):
+        """Região com o nome exato (sem acentos) ou a mais parecida, opcionalmente apenas da UF"""
+        cache_key = (name, uf)
+        if cache_key in self._cache:
+            return self._cache[cache_key]
+        key = normalize(name)
+        candidates = [i for i in self._names.get(key, []) if not uf or self._regions[i].uf == uf]
+        if not candidates and key:
+            grams = _trigrams(key)
+            common = Counter()
+            for gram in grams:
+                for i in self._grams.get(gram, ()):
+                    common[i] += 1
+            best = 0
+            for i, count in common.items():
+                if uf and self._regions[i].uf != uf:
+                    continue
+                score = 2 * count / (len(grams) + self._sizes[i])
+                if score > best + 1e-9:
+                    best, candidates = score, [i]
+                elif abs(score - best) <= 1e-9:
+                    candidates.append(i)
+            if best < min_score:
+                candidates = []
+        result = self._regions[max(candidates, key=self._rank)] if candidates else None
+        if len(self._cache) < 10000:
+            self._cache[cache_key] = result
+        return result
+
+
+def _base_regions():
+    regions = [BRAZIL]
+    for uf, info in br_ufs.items():
+        regions.append(Region(int(info["uid"]), info["name"], uf, STATE))
+    return regions
+
+
+_index = RegionIndex(_base_regions())
+_lock = threading.Lock()
+
+
+def update(records):
+    """Reconstrói o índice com os municípios dos registros do brasil.io"""
+    global _index
+    regions = _base_regions()
+    weights = {}
+    seen = set()
+    for rec in records:
+        code = rec.get("city_ibge_code")
+        if rec.get("city") and code and rec.get("state") in br_ufs and code not in seen:
+            seen.add(code)
+            regions.append(Region(int(code), rec["city"], rec["state"], CITY))
+            weights[int(code)] = rec.get("confirmed") or 0
+    index = RegionIndex(regions, weights)
+    with _lock:
+        _index = index
+    return index
+
+
+def get(code):
+    """Região pelo código do IBGE (ou "BR")"""
+    return _index.get(code)
+
+
+def resolve(text):
+    """Resolve o texto para uma Region, retorna None se não reconhecer"""
+    if not text or not text.strip():
+        return None
+    text = text.strip()
+    index = _index
+    upper = text.upper()
+    if upper == "BR" or normalize(text) == "brasil":
+        return BRAZIL
+    if upper in br_ufs:
+        return index.get(int(br_ufs[upper]["uid"]))
+    match = _qualified_re.match(text)
+    if match and match.group(2).upper() in br_ufs:
+        region = index.lookup(match.group(1), match.group(2).upper())
+        if region:
+            return region
+    return index.lookup(text)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo render
+Renderiza os gráficos (SeriesChart) e painéis (DataPanel) em um pool de processos
+
+Assim o matplotlib e o PIL não seguram o GIL das threads que respondem os
+comandos de texto, e a renderização usa mais de um núcleo. Cada processo do
+pool já inicia com o matplotlib e as fontes carregados (dasbot.render_worker).
+Com RENDER_WORKERS=0, ou se um processo do pool morrer, a renderização é
+feita na própria thread do comando.
+"""
+
+import io
+import os
+import time
+import logging
+import threading
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from dasbot import render_worker
+
+
+logger = logging.getLogger(__name__)
+
+render_workers = int(os.environ.get("RENDER_WORKERS", "2"))
+# tempo máximo, em segundos, de espera por uma imagem
+render_timeout = int(os.environ.get("RENDER_TIMEOUT", "30"))
+
+_pool = None
+_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=render_workers, initializer=render_worker.init,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def image(chart, timeout=None):
+    """Renderiza um SeriesChart ou DataPanel e retorna o png em um BytesIO
+    Gera TimeoutError se a imagem não ficar pronta no tempo limite
+    """
+    return images([chart], timeout)[0]
+
+
+def images(charts, timeout=None):
+    """Renderiza vários gráficos em paralelo no pool, retorna os BytesIO na mesma ordem
+    O tempo limite vale para o lote inteiro
+    """
+    if render_workers > 0:
+        pool = _get_pool()
+        deadline = time.monotonic() + (timeout or render_timeout)
+        try:
+            futures = [pool.submit(render_worker.render, chart) for chart in charts]
+            results = [f.result(timeout=max(deadline - time.monotonic(), 0)) for f in futures]
+        except BrokenProcessPool:
+            # um processo do pool morreu: o pool é recriado e este lote é renderizado aqui
+            logger.exception("Render pool broken, restarting")
+            _reset_pool(pool)
+            _get_pool()
+            results = [render_worker.render(chart) for chart in charts]
+        except TimeoutError:
+            for f in futures:
+                f.cancel()
+            raise
+    else:
+        results = [render_worker.render(chart) for chart in charts]
+    result = []
+    for data in results:
+        bio = io.BytesIO(data)
+        bio.name = 'series.png'
+        result.append(bio)
+    return result
+
+
+def shutdown():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool:
+        pool.shutdown(wait=False)
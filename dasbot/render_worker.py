@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo render_worker
+Funções executadas nos processos do pool de renderização (dasbot.render)
+
+O módulo não tem efeitos na importação: os processos do pool são iniciados
+com spawn e importam apenas o que o gráfico precisa, sem o log, os jobs e
+as fontes do bot.
+"""
+
+
+def init():
+    """Carrega o matplotlib, o PIL e as fontes antes do primeiro pedido"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from dasbot import corona
+
+    plt.close(plt.figure())
+    for size in [14, 18, 24]:
+        corona._font(size)
+
+
+def render(chart):
+    """png do SeriesChart ou DataPanel em bytes"""
+    return chart.image().getvalue()
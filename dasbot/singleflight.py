@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo singleflight
+Junta chamadas idênticas e simultâneas em uma única execução
+
+Quando sai um boletim, muitos usuários pedem a mesma região ao mesmo tempo.
+A primeira thread executa a função e as outras com a mesma chave esperam e
+recebem o mesmo resultado (ou a mesma exceção). Não é um cache: assim que a
+execução termina, a próxima chamada com a chave executa de novo.
+"""
+
+import logging
+import threading
+import functools
+
+from dasbot import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_calls_total = metrics.counter("dasbot_singleflight_calls_total", "Chamadas do singleflight por resultado",
+                               ("name", "result"))
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group(object):
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """Executa func(*args, **kwargs), ou espera a execução em andamento com a mesma chave"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        name = key[0] if isinstance(key, tuple) else key
+        if not leader:
+            _calls_total.inc(name, "shared")
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        _calls_total.inc(name, "executed")
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+_group = Group()
+
+
+def do(key, func, *args, **kwargs):
+    """Executa func no grupo global, a chave deve identificar o resultado (ex.: comando, região e versão)"""
+    return _group.do(key, func, *args, **kwargs)
+
+
+def shared(name):
+    """Decorator: chamadas simultâneas com os mesmos argumentos compartilham uma execução"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            return _group.do((name,) + args, func, *args)
+        return wrapper
+    return decorator
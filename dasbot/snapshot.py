@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo snapshot
+Guarda em disco a última versão dos dados de cada fonte, para que o bot
+responda logo após um restart enquanto as fontes são atualizadas
+
+Cada fonte tem um arquivo <nome>.snap com um cabeçalho binário fixo
+seguido dos dados serializados com pickle. A leitura é feita via mmap.
+"""
+
+import os
+import mmap
+import time
+import pickle
+import hashlib
+import logging
+import struct
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+snapshot_dir = os.environ.get("SNAPSHOT_DIR", "logs/snapshots")
+
+# versão do formato do arquivo, arquivos com outra versão são ignorados
+_FORMAT = 1
+_MAGIC = b"DSNP"
+# magic, formato, versão dos dados, data de gravação, sha1 dos dados, tamanho dos dados
+_header = struct.Struct("<4sHQd20sQ")
+
+_versions = {}
+_lock = threading.Lock()
+
+
+def _file_name(name):
+    return os.path.join(snapshot_dir, "{}.snap".format(name))
+
+
+def _read_header(name):
+    """Retorna (versão, sha1, data de gravação) do arquivo da fonte ou None"""
+    try:
+        with open(_file_name(name), "rb") as f:
+            header = f.read(_header.size)
+    except OSError:
+        return None
+    if len(header) < _header.size:
+        return None
+    magic, file_format, current, when, digest, _ = _header.unpack(header)
+    if magic != _MAGIC or file_format != _FORMAT:
+        return None
+    return current, digest, when
+
+
+def _current(name):
+    """Versão conhecida da fonte; na primeira chamada continua a partir da versão gravada em disco"""
+    if name not in _versions:
+        _versions[name] = _read_header(name) or (0, None, 0)
+    return _versions[name]
+
+
+def version(name):
+    """Versão atual dos dados da fonte, incrementada a cada mudança de conteúdo"""
+    return _versions.get(name, (0, None, 0))[0]
+
+
+def saved_at(name):
+    """Timestamp da última gravação dos dados da fonte"""
+    return _versions.get(name, (0, None, 0))[2]
+
+
+def published_version(name):
+    """Versão gravada em disco, que pode ter sido publicada por outro processo"""
+    header = _read_header(name)
+    return header[0] if header else 0
+
+
+def save(name, data):
+    """Grava os dados da fonte se o conteúdo mudou e retorna a versão atual"""
+    payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.sha1(payload).digest()
+    with _lock:
+        current, current_digest, _ = _current(name)
+        if digest == current_digest:
+            return current
+        current += 1
+        now = time.time()
+        _versions[name] = (current, digest, now)
+        try:
+            os.makedirs(snapshot_dir, exist_ok=True)
+            file_name = _file_name(name)
+            # cada processo usa o seu arquivo temporário, o os.replace publica a versão completa
+            temp_name = "{}.{}.tmp".format(file_name, os.getpid())
+            with open(temp_name, "wb") as f:
+                f.write(_header.pack(_MAGIC, _FORMAT, current, now, digest, len(payload)))
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_name, file_name)
+        except OSError as e:
+            logger.warning('Snapshot "%s" not saved: %s', name, e)
+        return current
+
+
+def load(name):
+    """Lê os dados gravados da fonte, retorna None se não houver snapshot válido"""
+    file_name = _file_name(name)
+    if not os.path.exists(file_name):
+        return None
+    try:
+        with open(file_name, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if len(mm) < _header.size:
+                return None
+            magic, file_format, current, when, digest, size = _header.unpack_from(mm)
+            if magic != _MAGIC or file_format != _FORMAT or len(mm) < _header.size + size:
+                return None
+            with memoryview(mm)[_header.size:_header.size + size] as payload:
+                data = pickle.loads(payload)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+        logger.warning('Snapshot "%s" not loaded: %s', name, e)
+        return None
+    with _lock:
+        if current > version(name):
+            _versions[name] = (current, digest, when)
+    return data
+
+
+def load_if_newer(name):
+    """Lê os dados gravados apenas se a versão em disco for mais nova que a versão em memória"""
+    if published_version(name) <= version(name):
+        return None
+    return load(name)
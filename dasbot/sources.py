@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modulo sources
+Atualiza as fontes de dados em segundo plano, cada uma com o seu intervalo
+
+Enquanto uma fonte é atualizada os comandos continuam respondendo com a
+última versão carregada (ou restaurada do snapshot). O load() de cada fonte
+só troca o cache global quando a carga termina com sucesso, e em caso de erro
+a próxima tentativa é feita com espera exponencial.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+
+from dasbot import breaker, snapshot
+
+
+logger = logging.getLogger(__name__)
+
+# espera inicial e máxima, em segundos, entre as tentativas após um erro
+backoff_base = int(os.environ.get("BACKOFF_BASE", "30"))
+backoff_max = int(os.environ.get("BACKOFF_MAX", "3600"))
+
+
+class Source(object):
+    """Estado de atualização de uma fonte"""
+
+    def __init__(self, name, loader, interval):
+        self.name = name
+        self.loader = loader
+        self.interval = interval
+        self.follower = False
+        self.circuit = None
+        self.restored = False
+        self.failures = 0
+        self.last_success = None
+        self.last_error = None
+        self.next_run = 0
+
+    def next_delay(self):
+        """Intervalo normal após sucesso, espera exponencial com jitter após erros"""
+        if not self.failures:
+            return self.interval
+        delay = min(backoff_max, backoff_base * 2 ** (self.failures - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+
+class SourceManager(object):
+
+    def __init__(self):
+        self._sources = {}
+        self._threads = []
+        self._listeners = []
+        self._stop = threading.Event()
+
+    @property
+    def sources(self):
+        return self._sources
+
+    def register(self, name, loader, interval, circuit=None):
+        """Registra o load() de uma fonte para ser executado a cada interval segundos
+        Com circuit (breaker.get(data_source)) as cargas passam pelo circuit breaker da fonte
+        """
+        source = Source(name, loader, interval)
+        source.circuit = circuit
+        self._sources[name] = source
+
+    def follow(self, name, restore, interval):
+        """Registra uma fonte que apenas lê os snapshots publicados por outro processo
+        restore() retorna True quando carregou uma versão nova
+        """
+        source = Source(name, restore, interval)
+        source.follower = True
+        self._sources[name] = source
+
+    def restored(self, name):
+        """Indica que a fonte já registrada carregou dados do snapshot na inicialização
+        Os listeners são chamados na thread da fonte, antes da primeira atualização
+        """
+        self._sources[name].restored = True
+
+    def add_listener(self, callback):
+        """Registra uma função chamada com o nome da fonte sempre que ela carrega uma nova versão dos dados
+        Uma carga com o mesmo conteúdo não muda a versão do snapshot e não chama os listeners
+        """
+        self._listeners.append(callback)
+
+    def _changed(self, name):
+        for callback in self._listeners:
+            try:
+                callback(name)
+            except Exception:
+                logger.exception('Source "%s" listener failed', name)
+
+    def is_managed(self, name):
+        """Indica se a fonte é atualizada em segundo plano
+        Nesse caso o _load_data das fontes não deve buscar os dados durante um comando
+        """
+        return bool(self._threads) and name in self._sources
+
+    def refresh(self, name):
+        """Executa o load() da fonte e retorna True se os dados foram atualizados"""
+        source = self._sources[name]
+        if source.follower:
+            return self._follow(source)
+        if source.circuit and not source.circuit.allow():
+            source.next_run = time.time() + min(source.interval, breaker.cooldown)
+            logger.info('Source "%s" skipped, circuit open', name)
+            return False
+        start = time.monotonic()
+        version = snapshot.version(name)
+        try:
+            ok = bool(source.loader())
+        except Exception as e:
+            logger.exception('Source "%s" load failed', name)
+            source.last_error = e
+            ok = False
+        if source.circuit:
+            # a carga completa tem várias páginas, a lentidão é medida apenas nos comandos
+            source.circuit.record(ok, 0)
+        if ok:
+            source.failures = 0
+            source.last_success = time.time()
+        else:
+            source.failures += 1
+        delay = source.next_delay()
+        source.next_run = time.time() + delay
+        logger.info('Source "%s" refresh %s in %.1fs, next in %.0fs', name,
+                    "ok" if ok else "failed ({})".format(source.failures), time.monotonic() - start, delay)
+        if ok and snapshot.version(name) != version:
+            self._changed(name)
+        return ok
+
+    def _follow(self, source):
+        changed = False
+        try:
+            changed = source.loader()
+        except Exception as e:
+            logger.exception('Source "%s" snapshot read failed', source.name)
+            source.last_error = e
+        if changed:
+            source.last_success = time.time()
+            logger.info('Source "%s" snapshot loaded', source.name)
+            self._changed(source.name)
+        source.next_run = time.time() + source.interval
+        return changed
+
+    def _run(self, name, first):
+        source = self._sources[name]
+        if source.restored:
+            source.restored = False
+            self._changed(name)
+        delay = first
+        while not self._stop.wait(delay):
+            self.refresh(name)
+            delay = max(0, self._sources[name].next_run - time.time())
+
+    def start(self, first=0):
+        """Inicia uma thread por fonte registrada"""
+        self._stop.clear()
+        for name in self._sources:
+            thread = threading.Thread(target=self._run, args=(name, first),
+                                      name="source-{}".format(name), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
+
+
+manager = SourceManager()
@@ -1,18 +1,30 @@
 # -*- coding: utf-8 -*-
 
 import copy
+import html
 import re
 import pytz
 
 from datetime import datetime
-from dateutil import parser
-from bs4 import BeautifulSoup
 
-from dasbot.corona import CoronaData, http_get
+from dasbot import snapshot, singleflight, regions
+from dasbot.sources import manager
+from dasbot.corona import CoronaData, http_get, parse_date
 
 
 _world_data = {}
 
+# leitura incremental da página, para evitar carregar a árvore HTML inteira
+_CHUNK_SIZE = 32 * 1024
+# margem mantida entre os blocos para não perder um trecho cortado ao meio
+_SCAN_OVERLAP = 8 * 1024
+
+_last_update_re = re.compile(rb"<div[^>]*>\s*(Last updated[^<]*)</div>")
+_brazil_row_re = re.compile(rb"href=[\"']country/brazil/[\"'][^>]*>.*?</td>(.*?)</tr>", re.S)
+_cell_re = re.compile(rb"<td[^>]*>(.*?)</td>", re.S)
+_tag_re = re.compile(rb"<[^>]+>")
+_date_re = re.compile(r"(\w+\s\d+,\s\d+,\s\d+:\d+\sGMT)$")
+
 
 class WorldOMeterData(CoronaData):
 
@@ -29,15 +41,16 @@ class WorldOMeterData(CoronaData):
         return [self._data.get(k, 0) or 0 for k in WorldOMeterData.categories()]
 
     def _update_stats(self):
-        if self._region == "BR":
+        if self.place is regions.BRAZIL:
             for k in WorldOMeterData.categories():
                 self._data[k] = int(self._raw_data[k].replace(",", ""))
-            self._version = parser.parse(self._raw_data["lastUpdated"]).timestamp()
+            self._version = parse_date(self._raw_data["lastUpdated"]).timestamp()
             self._last_date = datetime.fromtimestamp(self._version, pytz.timezone("America/Sao_Paulo"))
 
     def _load_data(self):
-        if not _world_data:
-            WorldOMeterData.load()
+        self._count_cache(bool(_world_data))
+        if not _world_data and not manager.is_managed("world"):
+            self._fetch(WorldOMeterData.load)
         self._raw_data = copy.deepcopy(_world_data)
         if self._raw_data:
             return True
@@ -55,21 +68,87 @@ class WorldOMeterData(CoronaData):
                tag['href'] == 'country/brazil/'
 
     @staticmethod
+    def _cell_text(cell):
+        return html.unescape(_tag_re.sub(b"", cell).decode("utf-8", "replace")).strip()
+
+    @staticmethod
+    def _scan_page(response):
+        """Procura a data de atualização e a linha do Brasil lendo a página em blocos
+        Para de ler assim que encontra as duas informações.
+        Retorna o dicionário de dados e o conteúdo lido até o momento
+        """
+        data = {}
+        cols = []
+        buffer = bytearray()
+        start = 0
+        while "lastUpdated" not in data or not cols:
+            chunk = response.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer.extend(chunk)
+            if "lastUpdated" not in data:
+                match = _last_update_re.search(buffer, start)
+                if match:
+                    date = _date_re.findall(WorldOMeterData._cell_text(match.group(1)))
+                    if date:
+                        data["lastUpdated"] = date[0]
+            if not cols:
+                match = _brazil_row_re.search(buffer, start)
+                if match:
+                    cols = [WorldOMeterData._cell_text(c) for c in _cell_re.findall(match.group(1))]
+            start = max(0, len(buffer) - _SCAN_OVERLAP)
+        if len(cols) > 4:
+            data["cases"] = cols[0]
+            data["deaths"] = cols[2]
+            data["recovery"] = cols[4]
+        return data, buffer
+
+    @staticmethod
+    def _parse_tree(content):
+        """Extração pela árvore HTML completa, usada quando a leitura rápida falha"""
+        from bs4 import BeautifulSoup
+
+        data = {}
+        main_page = BeautifulSoup(content, 'html.parser')
+        last_date_tag = main_page.find(WorldOMeterData._last_update_matcher)
+        if last_date_tag:
+            match = _date_re.findall(last_date_tag.text)
+            if match:
+                data["lastUpdated"] = match[0]
+        data_tag = main_page.find(WorldOMeterData._brazil_matcher)
+        cols = []
+        if data_tag:
+            for el in data_tag.parent.find_next_siblings("td"):
+                cols.append(el.text)
+        if cols:
+            data["cases"] = cols[0]
+            data["deaths"] = cols[2]
+            data["recovery"] = cols[4]
+        return data
+
+    @staticmethod
+    @singleflight.shared("world.load")
     def load():
+        """Carrega a página e só substitui o cache se todos os campos foram encontrados"""
         global _world_data
         response = http_get("https://www.worldometers.info/coronavirus/")
         if response:
-            main_page = BeautifulSoup(response, 'html.parser')
-            last_date_tag = main_page.find(WorldOMeterData._last_update_matcher)
-            if last_date_tag:
-                match = re.findall(r"(\w+\s\d+,\s\d+,\s\d+:\d+\sGMT)$", last_date_tag.text)
-                if match:
-                    _world_data["lastUpdated"] = match[0]
-            data_tag = main_page.find(WorldOMeterData._brazil_matcher)
-            cols = []
-            for el in data_tag.parent.find_next_siblings("td"):
-                cols.append(el.text)
-            if cols:
-                _world_data["cases"] = cols[0]
-                _world_data["deaths"] = cols[2]
-                _world_data["recovery"] = cols[4]
+            data, content = WorldOMeterData._scan_page(response)
+            if len(data) < 4:
+                content.extend(response.read())
+                data = WorldOMeterData._parse_tree(bytes(content))
+            if len(data) == 4:
+                _world_data = data
+                snapshot.save("world", data)
+                return True
+        return False
+
+    @staticmethod
+    def restore():
+        """Carrega os dados do snapshot se ele for mais novo que o cache, retorna True se carregou"""
+        global _world_data
+        data = snapshot.load_if_newer("world")
+        if data:
+            _world_data = data
+            return True
+        return False
@@ -0,0 +1,179 @@
+"""
+Exporta o histórico de casos para arquivos CSV ou Parquet
+
+As linhas são lidas em lotes (cursor do lado do servidor no PostgreSQL ou
+da série local em sqlite) e gravadas por fonte e data em
+<saída>/source=<fonte>/date=<data>/part-NNNNN.<formato>, com apenas um
+arquivo aberto por vez.
+
+python export.py --input db --format csv --output export
+python export.py --input history --format parquet --since 2020-04-01
+"""
+
+import os
+import re
+import csv
+import sys
+import argparse
+import datetime
+
+from dasbot import history
+from dasbot.db import CasesRepo
+
+# linhas por grupo de linhas no Parquet
+PARQUET_ROWS = 50000
+
+_unsafe_re = re.compile(r"[^\w.-]+")
+
+
+def _partition_value(value):
+    return _unsafe_re.sub("_", str(value)) or "_"
+
+
+class CsvPart(object):
+    def __init__(self, path, columns):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, columns, extrasaction="ignore")
+        self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetPart(object):
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Exportar em parquet precisa do pyarrow (pip install pyarrow)")
+        self._pa = pyarrow
+        self._path = path
+        self._columns = columns
+        self._rows = []
+        self._writer = None
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= PARQUET_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        data = {col: [row.get(col) for row in self._rows] for col in self._columns}
+        if self._writer is None:
+            table = self._pa.table(data)
+            self._writer = self._pa.parquet.ParquetWriter(self._path, table.schema)
+        else:
+            table = self._pa.table(data, schema=self._writer.schema)
+        self._writer.write_table(table)
+        self._rows = []
+
+    def close(self):
+        self._flush()
+        if self._writer:
+            self._writer.close()
+
+
+_formats = {"csv": CsvPart, "parquet": ParquetPart}
+
+
+class PartitionedWriter(object):
+    """Grava cada linha na partição da fonte e data, fechando a anterior quando a partição muda"""
+
+    def __init__(self, output, file_format, columns):
+        self.output = output
+        self.file_format = file_format
+        self.columns = columns
+        self.rows = 0
+        self.files = 0
+        self._key = None
+        self._part = None
+        self._parts = {}
+
+    def _open(self, key):
+        source, date = key
+        folder = os.path.join(self.output, "source={}".format(_partition_value(source)),
+                              "date={}".format(_partition_value(date)))
+        os.makedirs(folder, exist_ok=True)
+        # uma partição que reaparece (linhas fora de ordem) ganha um novo arquivo
+        number = self._parts.get(key, 0)
+        self._parts[key] = number + 1
+        path = os.path.join(folder, "part-{:05d}.{}".format(number, self.file_format))
+        self.files += 1
+        return _formats[self.file_format](path, self.columns)
+
+    def write(self, source, date, row):
+        key = (source, date)
+        if key != self._key:
+            self.close()
+            self._key = key
+            self._part = self._open(key)
+        self._part.write(row)
+        self.rows += 1
+
+    def close(self):
+        if self._part:
+            self._part.close()
+        self._part = None
+        self._key = None
+
+
+def _db_rows(since, batch_size, source):
+    where = ["1=1"]
+    params = []
+    if since:
+        where.append("source_date >= %s")
+        params.append(since)
+    if source:
+        where.append("data_source = %s")
+        params.append(source)
+    columns = ["source", "region", "cases", "deaths", "recovery", "date"]
+    rows = CasesRepo().iterate(" AND ".join(where), "data_source, source_date", batch_size, params)
+    return columns, ((row["source"], str(row["date"])[:10], row) for row in rows)
+
+
+def _history_rows(since, batch_size, source):
+    rows = history.iterate(source, since.isoformat() if since else None, batch_size)
+    return history.COLUMNS, ((row["source"], row["date"], row) for row in rows)
+
+
+def _date(text):
+    try:
+        return datetime.datetime.strptime(text, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError("data inválida, use AAAA-MM-DD: {}".format(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python export.py")
+    parser.add_argument("--input", choices=["db", "history"], default="db",
+                        help="tabela cases do PostgreSQL (POSTGRESQL_URL) ou série local (HISTORY_DB)")
+    parser.add_argument("--format", choices=sorted(_formats), default="csv")
+    parser.add_argument("--output", default="export")
+    parser.add_argument("--since", type=_date, help="apenas linhas a partir dessa data (AAAA-MM-DD)")
+    parser.add_argument("--source", help="apenas essa fonte")
+    parser.add_argument("--batch-size", type=int, default=2000, help="linhas lidas por vez")
+    options = parser.parse_args()
+
+    if options.input == "db":
+        columns, rows = _db_rows(options.since, options.batch_size, options.source)
+    else:
+        columns, rows = _history_rows(options.since, options.batch_size, options.source)
+
+    writer = PartitionedWriter(options.output, options.format, columns)
+    try:
+        for source, date, row in rows:
+            writer.write(source, date, row)
+    finally:
+        writer.close()
+    print("{} linhas exportadas em {} arquivos em {}".format(writer.rows, writer.files, options.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
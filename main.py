@@ -1,4 +1,11 @@
-from dasbot import bot
+import os
 
 if __name__ == '__main__':
-    bot.main()
+    # o bot só é importado aqui: os processos iniciados com spawn importam este módulo de novo
+    # com WORKERS > 1 o bot roda em vários processos, ver dasbot.cluster
+    if int(os.environ.get("WORKERS", "1")) > 1:
+        from dasbot import cluster
+        cluster.main()
+    else:
+        from dasbot import bot
+        bot.main()
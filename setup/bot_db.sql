@@ -25,9 +25,7 @@ CREATE TABLE public.jobcache (
     chat_id character varying(37),
 	repeat boolean DEFAULT TRUE,
 	only_new boolean DEFAULT FALSE,  
-    last_cases int DEFAULT 0,
-	last_deaths int DEFAULT 0,
-	last_recovery int DEFAULT 0,
+    last_version bigint DEFAULT 0,
     create_at timestamp with time zone DEFAULT now() NOT NULL
 );
 
@@ -36,6 +34,11 @@ ALTER TABLE public.jobcache OWNER TO "yldzrofu";
 ALTER TABLE ONLY public.jobcache
     ADD CONSTRAINT jobcache_pkey PRIMARY KEY (id);
 
+/*
+Bancos criados antes do changelog são atualizados pelo setup/migrate.sql,
+que o bot também executa ao carregar os jobs
+*/
+
 
 CREATE SEQUENCE public.botlog_id_seq
     START WITH 1
@@ -0,0 +1,7 @@
+/*
+Atualiza bancos criados por versões anteriores do setup/bot_db.sql
+Pode ser executado mais de uma vez
+*/
+
+-- changelog: os jobs guardam a versão dos dados já enviada no lugar dos últimos valores
+ALTER TABLE public.jobcache ADD COLUMN IF NOT EXISTS last_version bigint DEFAULT 0;
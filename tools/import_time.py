@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+Relatório do tempo de importação do bot
+
+Mede o custo de "import dasbot.bot" em um processo novo (python -X importtime),
+mostra os módulos mais caros e falha (exit code 1) se o tempo total passar do
+orçamento ou se algum subsistema pesado for carregado na inicialização.
+
+Uso: python tools/import_time.py [--budget MS] [--top N] [--module dasbot.bot]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+# orçamento padrão de inicialização, em milissegundos
+DEFAULT_BUDGET_MS = int(os.environ.get("IMPORT_BUDGET_MS", "1500"))
+
+# módulos que só devem ser carregados no primeiro uso
+LAZY_MODULES = ["matplotlib", "PIL", "bs4", "dateutil", "psycopg2", "numpy"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code):
+    return subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=ROOT, capture_output=True, text=True)
+
+
+def import_times(module):
+    """Retorna o total em ms e a lista de (cumulativo, próprio, módulo) do import"""
+    process = _run("import {}".format(module))
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+    rows = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        # a coluna do nome tem um espaço inicial e mais dois por nível de aninhamento
+        name = parts[2].rstrip()[1:]
+        rows.append((int(parts[1]) / 1000, int(parts[0]) / 1000, name))
+    total = sum(cumulative for cumulative, _, name in rows if not name.startswith(" "))
+    return total, rows
+
+
+def loaded_lazy_modules(module):
+    """Retorna os módulos pesados que foram carregados pelo import do bot"""
+    code = "import sys, {0}; print(' '.join(m for m in {1} if m in sys.modules))".format(module, LAZY_MODULES)
+    process = _run(code)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+    return process.stdout.split()
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--budget", type=int, default=DEFAULT_BUDGET_MS, help="orçamento em ms")
+    args.add_argument("--top", type=int, default=15, help="quantidade de módulos listados")
+    args.add_argument("--module", default="dasbot.bot")
+    options = args.parse_args()
+
+    total, rows = import_times(options.module)
+    print("{:>10} {:>10}  {}".format("cumul(ms)", "self(ms)", "módulo"))
+    for cumulative, own, name in sorted(rows, reverse=True)[:options.top]:
+        print("{:10.1f} {:10.1f}  {}".format(cumulative, own, name))
+    print("\nTotal: {:.1f} ms - Orçamento: {} ms".format(total, options.budget))
+
+    failed = False
+    if total > options.budget:
+        print("ERRO: tempo de importação acima do orçamento")
+        failed = True
+    lazy = loaded_lazy_modules(options.module)
+    if lazy:
+        print("ERRO: módulos carregados na inicialização: {}".format(", ".join(lazy)))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())